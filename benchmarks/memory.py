@@ -0,0 +1,81 @@
+"""Memory use of PathItem lists and generated ListItems.
+
+Usage: python benchmarks/memory.py [--count N] [--width W] [--scenario NAME]
+                                   [--output FILE]
+
+Items are created in memory with made-up names, without touching the
+file system, and measured with tracemalloc."""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import listphile
+from listphile import filelist, paths
+
+def _children(count:int, width:int) -> list:
+	# One folder holding `count` files, like PathItem.children(), with their
+	# paths built as they are when the items are listed
+	root = paths.PathItem(isdir=True)
+	items = [root._child(f'file{i:08d}.dat') for i in range(count)]
+	for item in items:
+		item.path
+	return items
+
+def _list_items(count:int, width:int) -> list:
+	# ListItems as yielded by generate(), for folders of `width` files
+	lister = filelist.FileLister()
+	file_format = lister.file_format
+	root = paths.PathItem(isdir=True)
+	items = []
+	for i in range(0, count, width):
+		folder = root._child(f'folder{i//width:06d}', True)
+		items.append(filelist.ListItem('dir', folder.path, lister.dir_format._get_props(folder)))
+		for j in range(min(width, count - i)):
+			item = folder._child(f'file{j:06d}.dat')
+			items.append(filelist.ListItem('file', item.path, file_format._get_props(item)))
+	return items
+
+SCENARIOS = {
+	'children': _children,
+	'list_items': _list_items
+}
+
+def measure(scenario:str, count:int, width:int) -> dict:
+	tracemalloc.start()
+	start = time.perf_counter()
+	items = SCENARIOS[scenario](count, width)
+	elapsed = time.perf_counter() - start
+	size, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del items
+	return {'scenario': scenario, 'count': count, 'bytes': size,
+	        'bytes_per_item': size/count, 'peak': peak, 'seconds': elapsed}
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('--count', '-n', type=int, action='append',
+	                    help='Number of items (can be repeated; default: 1000000)')
+	parser.add_argument('--width', type=int, default=1000,
+	                    help='Files per folder for list_items (default: %(default)s)')
+	parser.add_argument('--scenario', '-s', choices=list(SCENARIOS), action='append',
+	                    help='Scenario to run (can be repeated; default: all)')
+	parser.add_argument('--output', '-o', help='JSON file to write the results to')
+	args = parser.parse_args()
+	results = []
+	for scenario in args.scenario or SCENARIOS:
+		for count in args.count or [1000000]:
+			result = measure(scenario, count, args.width)
+			results.append(result)
+			print(f"{result['scenario']:<12} {result['count']:>10} items: "
+			      f"{result['bytes']/2**20:9.1f} MiB ({result['bytes_per_item']:.0f} B/item), "
+			      f"{result['seconds']:.1f} s")
+	if args.output:
+		with open(args.output, 'w') as file:
+			json.dump({'width': args.width, 'results': results}, file, indent='\t')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,174 @@
+"""Timings of writing, generating, parsing and comparing lists.
+
+Usage: python benchmarks/speed.py [--output FILE] [--compare BASELINE [CURRENT]]
+                                  [--case PATTERN] [--repeat N] [tree options]
+
+A synthetic tree (see tree.py) is made on tmpfs, along with a mutated copy
+for the comparisons. Every case is run `repeat` times and its best time is
+kept. Results can be saved as JSON and compared with an earlier run, in
+which case slower cases are flagged and the exit status is 1. With two
+files given to --compare, they are compared without running anything."""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing as ty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import listphile
+import tree
+
+PROPERTIES = {
+	'none': {},
+	'size': {'show_size': True},
+	'date': {'show_date': True},
+	'hash': {'show_hash': True},
+	'all':  {'show_size': True, 'show_date': True, 'show_hash': True}
+}
+FORMATS = ['plain', 'xml']
+
+def get_cases(old_tree:str, new_tree:str, work:str) -> ty.Dict[str,ty.Callable[[],ty.Any]]:
+	# Name -> function to time. Lists that later cases read are written up front.
+	cases = {}
+	for format_type in FORMATS:
+		for props, prop_options in PROPERTIES.items():
+			options = {'format_type': format_type, **prop_options}
+			list_path = os.path.join(work, f'{format_type}_{props}.txt')
+			cases[f'write_list/{format_type}/{props}'] = (
+				lambda options=options, list_path=list_path: listphile.write_list(old_tree, list_path, options))
+	options = {'format_type': 'binary', **PROPERTIES['all']}
+	cases['write_list/binary/all'] = lambda options=options: listphile.write_list(
+		old_tree, os.path.join(work, 'binary_all.bin'), options)
+
+	for props in ('none', 'all'):
+		options = PROPERTIES[props]
+		cases[f'generate/plain/{props}'] = lambda options=options: _consume(listphile.generate(old_tree, options))
+
+	all_lists = {}
+	for format_type in FORMATS + ['binary']:
+		options = {'format_type': format_type, **PROPERTIES['all']}
+		old_list = os.path.join(work, f'old_{format_type}' + ('.bin' if format_type == 'binary' else '.txt'))
+		listphile.write_list(old_tree, old_list, options)
+		all_lists[format_type] = old_list, options
+		cases[f'parse_list/{format_type}/all'] = (
+			lambda old_list=old_list, options=options: _consume(listphile.parse_list(old_list, options)))
+
+	old_list, options = all_lists['plain']
+	new_list = os.path.join(work, 'new_plain.txt')
+	listphile.write_list(new_tree, new_list, options)
+	cases['compare/lists'] = lambda: _consume(listphile.compare(
+		old_list, new_list, names_only=False, options=options))
+	cases['compare/lists/by_path'] = lambda: _consume(listphile.compare(
+		old_list, new_list, names_only=False, by_path=True, options=options))
+	cases['compare/lists/moves'] = lambda: _consume(listphile.compare(
+		old_list, new_list, names_only=False, detect_moves=True, options=options))
+	cases['compare/folder'] = lambda: _consume(listphile.compare(
+		old_list, new_tree, names_only=False, options=options))
+	return cases
+
+def _consume(iterator:ty.Iterable) -> int:
+	count = 0
+	for _ in iterator:
+		count += 1
+	return count
+
+def run(args:argparse.Namespace) -> dict:
+	params = tree.tree_params(args)
+	work = tempfile.mkdtemp(prefix='listphile-bench-', dir=tree.tmpfs_dir())
+	try:
+		old_tree = tree.make_tree(os.path.join(work, 'old'), **params)
+		new_tree = tree.make_tree(os.path.join(work, 'new'), **params)
+		tree.mutate_tree(new_tree, args.mutate, seed=args.seed + 1)
+		results = {}
+		for name, function in get_cases(old_tree, new_tree, work).items():
+			if args.case and not any(fnmatch.fnmatchcase(name, pattern) for pattern in args.case):
+				continue
+			runs = []
+			for _ in range(args.repeat):
+				start = time.perf_counter()
+				function()
+				runs.append(time.perf_counter() - start)
+			results[name] = {'seconds': min(runs), 'runs': runs}
+			print(f'{name:<28} {min(runs):8.3f} s', file=sys.stderr)
+		return {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		                 'python': platform.python_version(),
+		                 'platform': platform.platform(),
+		                 'commit': _git_commit(),
+		                 'tree': params, 'items': tree.count_items(old_tree),
+		                 'repeat': args.repeat},
+		        'results': results}
+	finally:
+		shutil.rmtree(work, ignore_errors=True)
+
+def _git_commit() -> ty.Optional[str]:
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+		                      cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def compare_results(baseline:dict, current:dict, threshold:float) -> ty.List[str]:
+	"""Print both runs' times side by side; return the names of cases that
+	got slower by more than `threshold` (a fraction)."""
+	if baseline['meta'].get('tree') != current['meta'].get('tree'):
+		print('Warning: the runs used different trees', file=sys.stderr)
+	regressions = []
+	for name, result in current['results'].items():
+		old = baseline['results'].get(name)
+		if old is None:
+			print(f'{name:<28} {"":>8}   {result["seconds"]:8.3f} s  (new)')
+			continue
+		ratio = result['seconds']/old['seconds'] if old['seconds'] else float('inf')
+		flag = ''
+		if ratio > 1 + threshold:
+			flag = 'REGRESSION'
+			regressions.append(name)
+		elif ratio < 1/(1 + threshold):
+			flag = 'faster'
+		print(f'{name:<28} {old["seconds"]:8.3f} -> {result["seconds"]:8.3f} s  {ratio:5.2f}x  {flag}')
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('--output', '-o', help='JSON file to write the results to')
+	parser.add_argument('--compare', '-c', nargs='+', metavar='FILE',
+	                    help='Baseline JSON results, and optionally current results instead of running')
+	parser.add_argument('--threshold', type=float, default=0.1,
+	                    help='Slowdown flagged as a regression (default: %(default)s)')
+	parser.add_argument('--case', action='append',
+	                    help='Glob pattern for the cases to run (can be repeated; default: all)')
+	parser.add_argument('--repeat', '-r', type=int, default=3,
+	                    help='Runs per case (default: %(default)s)')
+	parser.add_argument('--mutate', type=float, default=0.05,
+	                    help='Fraction of files changed in the compared tree (default: %(default)s)')
+	tree.add_arguments(parser)
+	args = parser.parse_args()
+	if args.compare and len(args.compare) > 2:
+		parser.error('--compare takes a baseline and at most one current result file')
+
+	if args.compare and len(args.compare) == 2:
+		with open(args.compare[1]) as file:
+			current = json.load(file)
+	else:
+		current = run(args)
+		if args.output:
+			with open(args.output, 'w') as file:
+				json.dump(current, file, indent='\t')
+		elif not args.compare:
+			json.dump(current, sys.stdout, indent='\t')
+			print()
+
+	if args.compare:
+		with open(args.compare[0]) as file:
+			baseline = json.load(file)
+		if compare_results(baseline, current, args.threshold):
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,102 @@
+"""Deterministic synthetic folder trees for benchmarks.
+
+Usage: python benchmarks/tree.py [DEST] [--depth D] [--fanout F] [--files N]
+                                 [--size BYTES] [--seed S]
+
+The same parameters always give the same names, sizes, contents and dates.
+Without DEST, the tree is made in a new temporary folder, on /dev/shm if it
+exists so that the benchmarks measure listphile rather than the disk."""
+import argparse
+import os
+import random
+import tempfile
+import typing as ty
+
+DATE = 1500000000 # fixed modification date, shifted by a few seconds per file
+
+def tmpfs_dir() -> ty.Optional[str]:
+	# Parent folder for temporary trees and lists
+	return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def make_tree(root:ty.Optional[str] = None, *, depth:int = 3, fanout:int = 5,
+              files:int = 30, size:int = 4096, seed:int = 0) -> str:
+	"""Create a tree of `depth` levels of `fanout` subfolders, with `files`
+	files in every folder. File sizes are random between 0 and twice
+	`size`. Returns the root folder."""
+	if root is None:
+		root = tempfile.mkdtemp(prefix='listphile-tree-', dir=tmpfs_dir())
+	rng = random.Random(seed)
+	_make_folder(root, depth, fanout, files, size, rng)
+	return root
+
+def _make_folder(folder:str, depth:int, fanout:int, files:int, size:int, rng:random.Random):
+	os.makedirs(folder, exist_ok=True)
+	for i in range(files):
+		write_file(os.path.join(folder, f'{_word(rng)}_{i:04d}.{rng.choice(_EXTENSIONS)}'),
+		           rng.randint(0, 2*size), rng)
+	if depth > 0:
+		for i in range(fanout):
+			_make_folder(os.path.join(folder, f'{_word(rng).capitalize()} {i:02d}'),
+			             depth - 1, fanout, files, size, rng)
+
+def write_file(path:str, size:int, rng:random.Random):
+	with open(path, 'wb') as file:
+		file.write(rng.randbytes(size))
+	date = DATE + rng.randrange(10000000)
+	os.utime(path, (date, date))
+
+def mutate_tree(root:str, fraction:float = 0.05, *, seed:int = 1) -> ty.Dict[str,int]:
+	"""Change a fraction of the files in a tree: rewrite, delete, rename or
+	add files next to them. Returns the number of changes of each kind."""
+	rng = random.Random(seed)
+	paths = sorted(os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names)
+	counts = {'changed': 0, 'removed': 0, 'renamed': 0, 'added': 0}
+	for path in rng.sample(paths, int(len(paths)*fraction)):
+		kind = rng.choice(list(counts))
+		if kind == 'changed':
+			write_file(path, rng.randint(0, 2*os.path.getsize(path) + 1), rng)
+		elif kind == 'removed':
+			os.remove(path)
+		elif kind == 'renamed':
+			folder, name = os.path.split(path)
+			os.rename(path, os.path.join(folder, 'renamed_' + name))
+		else:
+			write_file(path + '.new', rng.randint(0, 8192), rng)
+		counts[kind] += 1
+	return counts
+
+def count_items(root:str) -> int:
+	return sum(1 + len(names) for _, _, names in os.walk(root))
+
+_WORDS = ['alpha', 'beta', 'gamma', 'delta', 'notes', 'photo', 'track', 'report',
+          'draft', 'backup', 'data', 'image', 'scan', 'mix', 'demo', 'final']
+_EXTENSIONS = ['txt', 'jpg', 'png', 'mp3', 'flac', 'pdf', 'dat', 'py', 'json', 'zip']
+
+def _word(rng:random.Random) -> str:
+	return rng.choice(_WORDS)
+
+def add_arguments(parser:argparse.ArgumentParser):
+	parser.add_argument('--depth', type=int, default=3,
+	                    help='Levels of subfolders (default: %(default)s)')
+	parser.add_argument('--fanout', type=int, default=5,
+	                    help='Subfolders per folder (default: %(default)s)')
+	parser.add_argument('--files', type=int, default=30,
+	                    help='Files per folder (default: %(default)s)')
+	parser.add_argument('--size', type=int, default=4096,
+	                    help='Average file size in bytes (default: %(default)s)')
+	parser.add_argument('--seed', type=int, default=0,
+	                    help='Random seed (default: %(default)s)')
+
+def tree_params(args:argparse.Namespace) -> ty.Dict[str,int]:
+	return {key: getattr(args, key) for key in ('depth', 'fanout', 'files', 'size', 'seed')}
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('dest', nargs='?', help='Folder to create the tree in')
+	add_arguments(parser)
+	args = parser.parse_args()
+	root = make_tree(args.dest, **tree_params(args))
+	print(f'{root}: {count_items(root)} items')
+
+if __name__ == '__main__':
+	main()
@@ -1,12 +1,9 @@
 from . import compare as _compare, config as _config, format as _format, paths as _paths
-from .filelist import (FileLister, write_list, generate, parse_list)
-from .compare import (FileListComparer, compare)
+from .filelist import (FileLister, write_list, generate, parse_list, agenerate)
+from .compare import (FileListComparer, compare, acompare)
 from .config_helpers import (FormatType, DateType, NameType, GroupType,
-	grouped_sort_key, group_sort_key)
-from .format import add_property, list_properties
+	CompressionType, grouped_sort_key, group_sort_key)
+from .format import add_property, add_plugin, list_properties
+from . import plugins as _plugins
 
-try:
-	from .plugins import audio as _audio
-	_audio._add_props()
-except ImportError:
-	pass
+_plugins._register()
@@ -0,0 +1,276 @@
+from __future__ import annotations
+import bisect
+import hashlib
+import mmap
+from pathlib import Path
+import struct
+import typing as ty
+
+from . import dates, format, paths
+
+if ty.TYPE_CHECKING:
+	from . import config, filelist
+
+# Layout:
+# - header (_HEADER, padded to _HEADER_SIZE bytes)
+# - records (_RECORD followed by the digests), one per folder, file or
+#   ellipsis in list order
+# - string table: (string_count + 1) offsets into the following blob of
+#   UTF-8 names; records refer to names by index, so repeated names are
+#   only stored once
+# - folder index: the first record number of each folder, in increasing
+#   order, followed by the record number after its last descendant
+
+MAGIC = b'LPHBIN\x00\x01'
+_VERSION = 1
+_HEADER = struct.Struct('<8sHHBBHQQQQQ')
+_HEADER_SIZE = 64
+_RECORD = struct.Struct('<BBHIQd') # type, flags, depth, name, size, date
+_OFFSET = struct.Struct('<Q')
+
+_TYPES = ['file', 'dir', 'ellipsis']
+_TYPE_CODES = {item_type: i for i, item_type in enumerate(_TYPES)}
+
+# Header flags: stored properties
+_SIZE, _DATE, _HASH, _QUICKHASH = 1, 2, 4, 8
+# Record flags: digests that are present (hashes may be skipped by max size)
+_HAS_HASH, _HAS_QUICKHASH = 1, 2
+
+_DATE_PROPS = [None, 'cdate', 'mdate', 'ndate']
+_get_date = {
+	'cdate': lambda data: data.st_ctime,
+	'mdate': lambda data: data.st_mtime,
+	'ndate': lambda data: max(data.st_ctime, data.st_mtime)
+}
+
+def is_binary_list(path:paths.PathOrStr) -> bool:
+	try:
+		with open(str(path), 'rb') as file:
+			return file.read(len(MAGIC)) == MAGIC
+	except (FileNotFoundError, IsADirectoryError):
+		return False
+
+class Writer:
+	"""Write list items to a binary list. The file object has to be seekable,
+	as the header is written last."""
+
+	def __init__(self, file:ty.BinaryIO, lister:filelist.FileLister):
+		self.file = file
+		self.options = lister.options
+		props = lister.file_format.props if lister.file_format else set()
+		self.flags = ((_SIZE if 'size' in props else 0) |
+		              (_HASH if 'hash' in props else 0) |
+		              (_QUICKHASH if 'quickhash' in props else 0))
+		self.date_prop = next((prop for prop in _DATE_PROPS[1:] if prop in props), None)
+		if self.date_prop:
+			self.flags |= _DATE
+		self.digest_size = (hashlib.new(self.options.hash_algorithm).digest_size
+		                    if self.flags & (_HASH | _QUICKHASH) else 0)
+		self._digests = [(prop, flag) for prop, flag in (('hash', _HAS_HASH), ('quickhash', _HAS_QUICKHASH))
+		                 if prop in props]
+		self._empty_digest = bytes(self.digest_size)
+		self._no_digests = self._empty_digest*len(self._digests) # records are fixed-width
+		# folders are always stored, for the structure of the list
+		self._types = {'dir', 'dir_close'} | {item_type for item_type in ('file', 'ellipsis')
+		                                      if getattr(lister, item_type + '_format')}
+		self._names = {}
+		self._count = 0
+		self._open_dirs = []
+		self._dirs = []
+		file.write(bytes(_HEADER_SIZE))
+
+	def add(self, item_type:str, item:paths.PathItem):
+		if item_type not in self._types:
+			return
+		if item_type == 'dir_close':
+			self._dirs.append((self._open_dirs.pop(), self._count))
+			return
+		name = item.name or item.abspath.parts[-1]
+		name_index = self._names.setdefault(name, len(self._names))
+		flags, size, date, digests = 0, 0, 0.0, self._no_digests
+		if item_type == 'dir':
+			self._open_dirs.append(self._count)
+		elif item_type == 'file':
+			if self.flags & (_SIZE | _DATE):
+				data = item.data
+				size = data.st_size if self.flags & _SIZE else 0
+				date = _get_date[self.date_prop](data) if self.date_prop else 0.0
+			digests = []
+			for prop, flag in self._digests:
+				digest = format.Format._get_property[prop](item, self.options)
+				if digest:
+					flags |= flag
+					digests.append(bytes.fromhex(digest))
+				else:
+					digests.append(self._empty_digest)
+			digests = b''.join(digests)
+		self.file.write(_RECORD.pack(_TYPE_CODES[item_type], flags, item.depth,
+		                             name_index, size, date) + digests)
+		self._count += 1
+
+	def finish(self):
+		# Write the string table, folder index and header
+		strings_offset = self.file.tell()
+		names = [name.encode('utf-8') for name in self._names]
+		offset = 0
+		offsets = [offset]
+		for name in names:
+			offset += len(name)
+			offsets.append(offset)
+		self.file.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+		self.file.write(b''.join(names))
+
+		index_offset = self.file.tell()
+		self._dirs.sort()
+		self.file.write(struct.pack(f'<{len(self._dirs)}Q', *(start for start, end in self._dirs)))
+		self.file.write(struct.pack(f'<{len(self._dirs)}Q', *(end for start, end in self._dirs)))
+
+		self.file.seek(0)
+		self.file.write(_HEADER.pack(MAGIC, _VERSION, self.flags,
+		                             _DATE_PROPS.index(self.date_prop), self.digest_size, 0,
+		                             self._count, len(names), strings_offset,
+		                             index_offset, len(self._dirs)))
+		self.file.seek(0, 2)
+
+class BinaryList:
+	"""A memory-mapped binary list, which can be read from any folder
+	without going through the records before it."""
+
+	def __init__(self, path:paths.PathOrStr, options:ty.Optional[config.Options] = None):
+		self._file = open(str(path), 'rb')
+		try:
+			self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError: # empty file
+			self._file.close()
+			raise ValueError(f'not a binary list: {path}')
+		(magic, version, self.flags, date_prop, self.digest_size, _, self.count,
+		 string_count, strings_offset, index_offset, dir_count) = _HEADER.unpack_from(self._map)
+		if magic != MAGIC or version != _VERSION:
+			self.close()
+			raise ValueError(f'not a binary list: {path}')
+		self.date_prop = _DATE_PROPS[date_prop]
+		self.date_format = options.date_format if options else '%Y%m%d%H%M%S'
+		self._digest_props = [(prop, flag) for prop, flag, header_flag in
+		                      (('hash', _HAS_HASH, _HASH), ('quickhash', _HAS_QUICKHASH, _QUICKHASH))
+		                      if self.flags & header_flag]
+		self.record_size = _RECORD.size + self.digest_size*len(self._digest_props)
+
+		view = memoryview(self._map)
+		self._records = view[_HEADER_SIZE:_HEADER_SIZE + self.count*self.record_size]
+		blob_offset = strings_offset + (string_count + 1)*_OFFSET.size
+		self._string_offsets = view[strings_offset:blob_offset].cast('Q')
+		self._strings = view[blob_offset:blob_offset + self._string_offsets[-1]]
+		index_size = dir_count*_OFFSET.size
+		self._dir_starts = view[index_offset:index_offset + index_size].cast('Q')
+		self._dir_ends = view[index_offset + index_size:index_offset + 2*index_size].cast('Q')
+
+	def __len__(self) -> int:
+		return self.count
+
+	def __enter__(self) -> BinaryList:
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		for attr in ('_records', '_string_offsets', '_strings', '_dir_starts', '_dir_ends'):
+			if hasattr(self, attr):
+				getattr(self, attr).release()
+		self._map.close()
+		self._file.close()
+
+	def name(self, index:int) -> str:
+		return str(self._strings[self._string_offsets[index]:self._string_offsets[index + 1]], 'utf-8')
+
+	def record(self, number:int) -> ty.Tuple[str,int,str]:
+		# (item type, depth, name) of a record
+		item_type, _, depth, name, _, _ = _RECORD.unpack_from(self._records, number*self.record_size)
+		return _TYPES[item_type], depth, self.name(name)
+
+	def items(self, start:int = 0, stop:ty.Optional[int] = None, *,
+	          base:ty.Optional[Path] = None) -> ty.Generator[filelist.ListItem, None, None]:
+		"""Yield the records in a range as ListItems, with paths relative to
+		`base`, the parent folder of the first record (or its own path if
+		it's a root folder)."""
+		from .filelist import ListItem
+		stop = self.count if stop is None else stop
+		record_size, digest_size = self.record_size, self.digest_size
+		size_flag, date_prop, digest_props = self.flags & _SIZE, self.date_prop, self._digest_props
+		get_date = dates.get_formatter(self.date_format)
+		names = {}
+		parents = {}
+		for number in range(start, stop):
+			offset = number*record_size
+			item_type, flags, depth, name_index, size, date = _RECORD.unpack_from(self._records, offset)
+			item_type = _TYPES[item_type]
+			name = names.get(name_index)
+			if name is None:
+				name = names[name_index] = self.name(name_index)
+			props = format.Props(depth=depth, name=name)
+
+			if item_type == 'ellipsis':
+				path = parents.get(depth, base or Path(''))
+				del props['name']
+			elif depth == 0:
+				path = Path('')
+			else:
+				parent = parents.get(depth - 1)
+				if parent is None: # first record of a subtree
+					parent = base or Path('')
+				path = parent / name
+			if item_type == 'dir':
+				parents[depth] = path
+			elif item_type == 'file':
+				if size_flag:
+					props['size'] = size
+				if date_prop:
+					props[date_prop] = get_date(date)
+				offset += _RECORD.size
+				for prop, flag in digest_props:
+					props[prop] = (self._records[offset:offset + digest_size].hex()
+					               if flags & flag else '')
+					offset += digest_size
+			yield ListItem(item_type, path, props)
+
+	def __iter__(self) -> ty.Iterator[filelist.ListItem]:
+		return self.items()
+
+	def find(self, path:paths.PathOrStr) -> ty.Optional[ty.Tuple[int,int]]:
+		"""Record range (start, stop) of a file or folder and its contents,
+		given its path relative to the (first) base folder, or None if it's
+		not in the list."""
+		if self.count == 0:
+			return None
+		start, stop = 0, self._dir_end(0)
+		for depth, part in enumerate(paths._parse_path(path).parts, start=1):
+			for number in self._children(start, stop):
+				item_type, child_depth, name = self.record(number)
+				if name == part:
+					start, stop = number, (self._dir_end(number) if item_type == 'dir'
+					                       else number + 1)
+					break
+			else:
+				return None
+		return start, stop
+
+	def subtree(self, path:paths.PathOrStr) -> ty.Generator[filelist.ListItem, None, None]:
+		"""Yield the items in a folder, with paths relative to the base folder."""
+		found = self.find(path)
+		if found is None:
+			raise FileNotFoundError(path)
+		parent = paths._parse_path(path).parent
+		yield from self.items(*found, base=parent if parent != Path('.') else Path(''))
+
+	def _dir_end(self, number:int) -> int:
+		index = bisect.bisect_left(self._dir_starts, number)
+		if index < len(self._dir_starts) and self._dir_starts[index] == number:
+			return self._dir_ends[index]
+		return number + 1
+
+	def _children(self, start:int, stop:int) -> ty.Generator[int, None, None]:
+		# Record numbers of a folder's direct children, skipping over subfolders
+		number = start + 1
+		while number < stop:
+			yield number
+			number = self._dir_end(number)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import os
+import threading
+import time
+import typing as ty
+
+from . import paths
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+	dev      INTEGER NOT NULL,
+	ino      INTEGER NOT NULL,
+	size     INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	kind     TEXT    NOT NULL,
+	value    TEXT    NOT NULL,
+	used     INTEGER NOT NULL,
+	PRIMARY KEY (dev, ino, size, mtime_ns, kind)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+'''
+
+_Key = ty.Tuple[int,int,int,int,str]
+
+class FileCache:
+	"""Persistent store for per-file values such as hashes.
+
+	Entries are keyed by device, inode, size and modification time, so a
+	value is reused as long as the file hasn't been changed or replaced.
+	When the cache holds more than `max_entries` values, the least recently
+	used ones are removed on closing. If `verify` is True, cached values are
+	recomputed anyway, and a warning is printed when they differ. Files smaller
+	than `min_size` bypass the cache, as reading them is cheaper than a lookup."""
+
+	def __init__(self, path:paths.PathOrStr, *, max_entries:ty.Optional[int] = None,
+	             verify:bool = False, min_size:int = 64*1024, commit_interval:int = 1000):
+		self.path = paths._parse_path(path)
+		self.max_entries = max_entries
+		self.verify = verify
+		self.min_size = min_size
+		self.commit_interval = commit_interval
+		import sqlite3 # only needed with a cache file
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+		self._conn.executescript(_SCHEMA)
+		self._stamp = time.time_ns()
+		self._used = []
+		self._changes = 0
+
+	def __enter__(self) -> FileCache:
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	@staticmethod
+	def _key(data:os.stat_result, kind:str) -> _Key:
+		return (data.st_dev, data.st_ino, data.st_size, data.st_mtime_ns, kind)
+
+	def get(self, data:os.stat_result, kind:str) -> ty.Optional[str]:
+		key = self._key(data, kind)
+		with self._lock:
+			row = self._conn.execute(
+				'SELECT value FROM entries WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND kind=?',
+				key).fetchone()
+			if row is None:
+				return None
+			self._used.append(key)
+			self._tick()
+		return row[0]
+
+	def set(self, data:os.stat_result, kind:str, value:str):
+		key = self._key(data, kind)
+		with self._lock:
+			self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?)',
+			                   key + (value, self._stamp))
+			self._tick()
+
+	def fetch(self, item:paths.PathItem, kind:str, compute:ty.Callable[[],str]) -> str:
+		# Return the cached value for the item, or compute and store it
+		data = item.data
+		if data.st_size < self.min_size:
+			return compute()
+		value = self.get(data, kind)
+		if value is None or self.verify:
+			new_value = compute()
+			if value is not None and value != new_value:
+				print(f'Cached {kind} mismatch for {item.abspath}: {value} != {new_value}')
+			if value != new_value:
+				self.set(data, kind, new_value)
+			value = new_value
+		return value
+
+	def _tick(self):
+		self._changes += 1
+		if self._changes >= self.commit_interval:
+			self._flush()
+
+	def _flush(self):
+		if self._used:
+			self._conn.executemany(
+				'UPDATE entries SET used=? WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND kind=?',
+				((self._stamp,) + key for key in self._used))
+			self._used = []
+		self._conn.commit()
+		self._changes = 0
+
+	def _evict(self):
+		if not self.max_entries:
+			return
+		count = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+		if count > self.max_entries:
+			self._conn.execute(
+				'DELETE FROM entries WHERE (dev, ino, size, mtime_ns, kind) IN '
+				'(SELECT dev, ino, size, mtime_ns, kind FROM entries ORDER BY used LIMIT ?)',
+				(count - self.max_entries,))
+			self._conn.commit()
+
+	def close(self):
+		with self._lock:
+			if self._conn is None:
+				return
+			self._flush()
+			self._evict()
+			self._conn.close()
+			self._conn = None
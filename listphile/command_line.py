@@ -1,9 +1,12 @@
 import argparse
+import os
+import re
 import sys
 
-#from . import compare
+from .compare import FileListComparer
 from . import config_helpers as ch
 from . import filelist
+from . import streams
 
 def _list_enum(e):
 	return [x.name.lower() for x in e]
@@ -18,6 +21,12 @@ def main(test_args=None):
 	output_options.add_argument('--append', action='store_true', help='Append to the output file instead of overwriting it.')
 	output_options.add_argument('--header', default='', help='Text to be printed before the file list.')
 	output_options.add_argument('--footer', default='', help='Text to be printed after the file list.')
+	output_options.add_argument('--compression', '-z', default=None, type=str.lower, choices=_list_enum(ch.CompressionType), help='Compress the output file. By default, this is based on its extension (.gz, .bz2, .xz or .lzma).')
+	output_options.add_argument('--compression-level', type=int, default=None, help='Compression level (or preset for lzma).')
+	output_options.add_argument('--buffer-size', type=int, default=1024*1024, help='Number of bytes collected before writing them to the output file. (default: %(default)s)')
+	output_options.add_argument('--save-state', action='store_true', help='Save the folder modification times to a sidecar file next to the list, for use with --previous.')
+	output_options.add_argument('--stats', action='store_true', help='Print counts and the time spent in each phase (reading folders, stat calls, hashing, formatting and writing) to stderr when done.')
+	output_options.add_argument('--progress', action='store_true', help='Show the number of items listed so far on stderr, updated every second.')
 
 	format_options = options_parser.add_argument_group('General format options')
 	format_options.add_argument('--format-type', '-f', default='plain', type=str.lower, choices=_list_enum(ch.FormatType), help='Format family to use. (default: %(default)s)')
@@ -33,6 +42,12 @@ def main(test_args=None):
 	filter_options.add_argument('--no-folders', dest='show_folders', action='store_false', help='Exclude directories.')
 	filter_options.add_argument('--no-files', dest='show_files', action='store_false', help='Exclude files.')
 	filter_options.add_argument('--filter-hidden', action='store_true', help='Exclude hidden files.')
+	filter_options.add_argument('--exclude', '-x', action='append', metavar='GLOB', help='Exclude files and folders matching a gitignore-style glob, without entering excluded folders. Can be repeated.')
+	filter_options.add_argument('--exclude-regex', dest='exclude', action='append', type=re.compile, metavar='REGEX', help='Exclude files and folders whose relative path (ending in / for folders) matches a regular expression. Can be repeated.')
+	filter_options.add_argument('--include', '-i', action='append', metavar='GLOB', help='Only include files matching a gitignore-style glob. Can be repeated.')
+	filter_options.add_argument('--include-regex', dest='include', action='append', type=re.compile, metavar='REGEX', help='Only include files whose relative path matches a regular expression. Can be repeated.')
+	filter_options.add_argument('--walk-workers', type=int, default=0, help='Number of threads reading folders ahead of the output. 0 to read folders one at a time. (default: %(default)s)')
+	filter_options.add_argument('--parse-workers', type=int, default=0, help='Number of processes matching the lines of an uncompressed input list. 0 to parse it in the main process. (default: %(default)s)')
 	filter_options.add_argument('--item-grouping', default='filesfirst', type=str.lower, choices=_list_enum(ch.GroupType), help='Set the relative order of child folders and files. (default: %(default)s)')
 
 	prop_options = options_parser.add_argument_group('Item property format options')
@@ -42,18 +57,37 @@ def main(test_args=None):
 	prop_options.add_argument('--show-date', '--date',  action='store_true', help='Display file dates.')
 	prop_options.add_argument('--date-type', default='newest', type=str.lower, choices=_list_enum(ch.DateType), help='The type of date to display. (default: %(default)s)')
 	prop_options.add_argument('--date-format', default='%Y%m%d%H%M%S', help='The date format in `datetime.strftime` syntax. (default: "%(default)s")')
-	prop_options.add_argument('--show-hash', '--hash', action='store_true', help='Display the SHA-1 hash for files.')
+	prop_options.add_argument('--show-hash', '--hash', action='store_true', help='Display the hash for files.')
+	prop_options.add_argument('--show-quick-hash', '--quick-hash', action='store_true', help='Display a quick hash for files, based on their size and three sampled chunks.')
+	prop_options.add_argument('--hash-algorithm', default='sha1', help='Hash algorithm supported by hashlib, e.g. sha1, sha256, md5 or blake2b. (default: %(default)s)')
+	prop_options.add_argument('--hash-max-size', type=int, default=None, help='Skip hashing files larger than this number of bytes.')
+	prop_options.add_argument('--quick-hash-size', type=int, default=64*1024, help='Size in bytes of each chunk sampled for the quick hash. (default: %(default)s)')
+	prop_options.add_argument('--cache-file', default=None, help='SQLite file for caching file hashes between runs. Relative paths are with respect to the current working directory.')
+	prop_options.add_argument('--cache-size', type=int, default=10000000, help='Maximum number of entries kept in the cache file. (default: %(default)s)')
+	prop_options.add_argument('--verify-cache', action='store_true', help='Recompute cached hashes and warn about mismatches.')
+	prop_options.add_argument('--hash-workers', type=int, default=0, help='Number of threads hashing files ahead of the output. 0 to hash files one at a time. (default: %(default)s)')
 	prop_options.add_argument('--show-hidden', action='store_true', help='Mark hidden files.')
 	prop_options.add_argument('--hidden', default='*', help='String used for marking hidden files. (default: "%(default)s")')
 
 	list_parser = subparsers.add_parser('list', parents=[options_parser])
 	list_parser.add_argument('folder', nargs='?', default='', help='Input folder.')
 	list_parser.add_argument('--output', '-o', nargs='?', default=sys.stdout, const='filelist.txt', help='Output file path. If no value provided, use the default filename; if omitted entirely, print to the screen. Relative paths are with respect to the first input folder by default (see --rel-to-cwd).')
+	list_parser.add_argument('--previous', default=None, help='A previous list saved with --save-state (which can be the output file itself). Entries of unchanged folders are copied from it instead of being read again.')
 
-	#compare_parser = subparsers.add_parser('compare', parents=[options_parser])
-	#compare_parser.add_argument('source1', default='filelist.txt')
-	#compare_parser.add_argument('source2', default='')
-	#compare_parser.add_argument('--output', '-o', nargs='?', default=sys.stdout, const='comparison.txt')
+	compare_parser = subparsers.add_parser('compare', parents=[options_parser])
+	compare_parser.add_argument('old_list', help='Old list file or folder.')
+	compare_parser.add_argument('new_list', nargs='?', default='.', help='New list file or folder. (default: the current folder)')
+	compare_parser.add_argument('--output', '-o', nargs='?', default=sys.stdout, const='comparison.txt', help='Output file path, relative to the current working directory. If no value provided, use the default filename; if omitted entirely, print to the screen.')
+	compare_options = compare_parser.add_argument_group('Comparison options')
+	compare_options.add_argument('--compare-props', dest='names_only', action='store_false', help='Also compare the file properties in the format (hash, quick hash, size and dates) to find changed files.')
+	compare_options.add_argument('--tiered', action='store_true', help='With --compare-props and a folder source, decide on the size and date first, and only hash the files of the folder that those cannot tell apart.')
+	compare_options.add_argument('--skip-children', action='store_true', help='Omit the contents of folders that only appear in one source.')
+	compare_options.add_argument('--by-path', action='store_true', help='Match items by their relative paths, for sources that are sorted differently.')
+	compare_options.add_argument('--index-size', type=int, default=1000000, help='Number of old items kept in memory for --by-path before sorting both sources in temporary files. (default: %(default)s)')
+	compare_options.add_argument('--detect-moves', action='store_true', help='Report deleted and added files or folders with the same contents as moves.')
+	compare_options.add_argument('--move-window', type=int, default=100000, help='Number of unmatched items kept waiting for a move. (default: %(default)s)')
+	compare_options.add_argument('--show-matches', action='store_true', help='Also print items that are the same in both sources.')
+	compare_options.add_argument('--no-threads', dest='read_ahead', action='store_false', help='Read the two sources in the main thread instead of one background thread each.')
 
 	if type(test_args) is str:
 		test_args = test_args.split(' ')
@@ -66,7 +100,58 @@ def main(test_args=None):
 		run_compare(args)
 
 def run_list(args):
-	filelist.write_list(args.folder, args.output, args.__dict__)
+	options = dict(args.__dict__)
+	show_stats = options.pop('stats')
+	if options.pop('progress'):
+		options['progress'] = _print_progress
+	lister = filelist.FileLister(**options)
+	try:
+		lister.write_list(args.folder, args.output, previous_list=args.previous)
+	finally:
+		if args.progress:
+			print(file=sys.stderr)
+	if show_stats:
+		print(lister.stats, file=sys.stderr)
+
+def _print_progress(stats):
+	print(f'\r{stats.dirs} folders, {stats.files} files, {stats.elapsed:.0f} s',
+	      end='', file=sys.stderr, flush=True)
+
+_compare_args = ['old_list', 'new_list', 'skip_children', 'names_only', 'by_path',
+                 'index_size', 'detect_moves', 'move_window', 'read_ahead', 'tiered']
+_diff_symbols = {'addition': '+', 'deletion': '-', 'change': '*', 'move': '>', 'match': '='}
 
 def run_compare(args):
-	raise NotImplementedError()
+	options = dict(args.__dict__)
+	compare_args = {arg: options.pop(arg) for arg in _compare_args}
+	show_stats = options.pop('stats')
+	if options.pop('progress'):
+		options['progress'] = _print_progress
+	comparer = FileListComparer(**options)
+	if args.output is sys.stdout:
+		output = sys.stdout
+	else:
+		output = streams.open_list(args.output, 'a' if args.append else 'w',
+		                           compression=args.compression,
+		                           compression_level=args.compression_level,
+		                           buffer_size=args.buffer_size)
+	try:
+		# lines are written as soon as the differences are found
+		for diff in comparer.compare(**compare_args):
+			if diff.item_type not in ('file', 'dir') or (diff.diff_type == 'match' and not args.show_matches):
+				continue
+			output.write(_diff_line(diff) + '\n')
+	finally:
+		if output is not sys.stdout:
+			output.close()
+		if args.progress:
+			print(file=sys.stderr)
+	if show_stats:
+		print(comparer.stats, file=sys.stderr)
+
+def _diff_line(diff):
+	path = str(diff.path) + (os.sep if diff.item_type == 'dir' and diff.path.parts else '')
+	if diff.diff_type == 'move':
+		old_path = str(diff.old_path) + (os.sep if diff.item_type == 'dir' else '')
+		return f'{_diff_symbols["move"]} {old_path} -> {path}'
+	return f'{_diff_symbols[diff.diff_type]} {path}'
@@ -1,26 +1,85 @@
+from __future__ import annotations
+import collections
+import hashlib
 import io
+import itertools
+import operator
 import os
 from pathlib import Path
+import time
 import typing as ty
 
 from . import config_helpers as ch
-from . import format, filelist, paths
+from . import format, filelist, paths, stats
 from .filelist import ListItem
 
+if ty.TYPE_CHECKING:
+	import concurrent.futures
+
 class DiffItem(ty.NamedTuple):
 	diff_type:str
 	item_type:str
 	path:Path
 	old_props:ty.Optional[format.Props] = None
 	new_props:ty.Optional[format.Props] = None
+	old_path:ty.Optional[Path] = None # for moves
 
 class FileListComparer(filelist.FileLister):
+	_sort_keys = ((None, None), (None, None)) # last two (ListItem, sort key) pairs
+	_live = (None, None) # base folders of the old and new sources, for tiered comparisons
+
 	def compare(self, old_list:ty.Union[paths.PathOrStr,ty.TextIO],
 	            new_list:ty.Union[paths.PathOrStr,ty.TextIO] = '.', *,
-	            skip_children:bool = False, names_only:bool = True
+	            skip_children:bool = False, names_only:bool = True,
+	            by_path:bool = False, index_size:int = 1000000,
+	            detect_moves:bool = False, move_window:int = 100000,
+	            read_ahead:bool = False, tiered:bool = False
 	            ) -> ty.Generator[DiffItem, None, None]:
 		old_gen = self._get_gen(old_list)
 		new_gen = self._get_gen(new_list)
+		if read_ahead:
+			# parse or walk each source in its own thread
+			from . import prefetch
+			old_gen = prefetch.read_ahead(old_gen)
+			new_gen = prefetch.read_ahead(new_gen)
+		tiered = tiered and not names_only
+		if tiered:
+			# folders are walked without the content hashes, which are
+			# computed later for the files that need them
+			self._live = tuple(_live_folder(source) for source in (old_list, new_list))
+			if self.file_format:
+				self._deferred_props = _CONTENT_PROPS & self.file_format.props
+		# one run: the sources' counts are added to the same stats, and the
+		# cache is kept open until both are done (and for the lookups of
+		# tiered comparisons after the walk)
+		self._start_stats()
+		self.options._get_cache()
+		try:
+			if by_path:
+				diffs = self._compare_by_path(old_gen, new_gen, skip_children=skip_children,
+				                              names_only=names_only, index_size=index_size)
+			else:
+				diffs = self._compare_in_order(old_gen, new_gen, skip_children=skip_children,
+				                               names_only=names_only)
+			if detect_moves:
+				if self._deferred_props:
+					diffs = self._hash_unmatched(diffs)
+				diffs = _MoveDetector(move_window).run(diffs)
+			yield from diffs
+		finally:
+			# stop the sources (and wait for their threads) before closing the cache
+			old_gen.close()
+			new_gen.close()
+			if tiered:
+				self._live = (None, None)
+				self._deferred_props = frozenset()
+			self.options._close_cache()
+			self.stats.end_time = time.perf_counter()
+		self._report_progress()
+
+	def _compare_in_order(self, old_gen:ty.Iterator[ListItem], new_gen:ty.Iterator[ListItem], *,
+	                      skip_children:bool, names_only:bool
+	                      ) -> ty.Generator[DiffItem, None, None]:
 		empty_item = ListItem(None, None, None)
 		item_grouping = ch._get_enum(ch.GroupType, self.options.item_grouping)
 
@@ -32,7 +91,7 @@ class FileListComparer(filelist.FileLister):
 			if diff == 0:
 				assert old.path == new.path
 				if (old.item_type == 'file' and not names_only and
-				    not self._compare_files(old.props, new.props)):
+				    not self._files_match(old, new)):
 					yield DiffItem('change', new.item_type, new.path, old.props, new.props)
 				else:
 					yield DiffItem('match', new.item_type, new.path, old.props, new.props)
@@ -63,6 +122,80 @@ class FileListComparer(filelist.FileLister):
 				while can_skip_children and new.props and self._get_depth(new.props) > new_dir_depth:
 					new = next(new_gen, empty_item)
 
+	def _compare_by_path(self, old_gen:ty.Iterator[ListItem], new_gen:ty.Iterator[ListItem], *,
+	                     skip_children:bool, names_only:bool, index_size:int
+	                     ) -> ty.Generator[DiffItem, None, None]:
+		# Hash join on relative paths: index the old list, then look up each
+		# new item. If the old list doesn't fit in index_size entries, both
+		# lists are sorted by path using temporary files, and merged instead.
+		old_index = {}
+		old_keyed = _keyed(old_gen)
+		for key, old in old_keyed:
+			old_index[key] = old
+			if len(old_index) > index_size:
+				yield from self._merge_by_path(
+					_sort_by_path(itertools.chain(old_index.items(), old_keyed), index_size),
+					_sort_by_path(_keyed(new_gen), index_size),
+					skip_children=skip_children, names_only=names_only)
+				return
+
+		unmatched_dirs = set()
+		for key, new in _keyed(new_gen):
+			old = old_index.pop(key, None)
+			if old is not None:
+				yield self._diff_matched(old, new, names_only)
+			elif not (skip_children and _in_unmatched(key, unmatched_dirs)):
+				yield DiffItem('addition', new.item_type, new.path, None, new.props)
+		unmatched_dirs.clear()
+		for key, old in old_index.items():
+			if not (skip_children and _in_unmatched(key, unmatched_dirs)):
+				yield DiffItem('deletion', old.item_type, old.path, old.props, None)
+
+	def _merge_by_path(self, old_sorted:ty.Iterator[ty.Tuple[tuple,ListItem]],
+	                   new_sorted:ty.Iterator[ty.Tuple[tuple,ListItem]], *,
+	                   skip_children:bool, names_only:bool
+	                   ) -> ty.Generator[DiffItem, None, None]:
+		# Merge join of two lists sorted by path key
+		old_dirs, new_dirs = set(), set()
+		old = next(old_sorted, None)
+		new = next(new_sorted, None)
+		while old is not None or new is not None:
+			if new is None or (old is not None and old[0] < new[0]):
+				if not (skip_children and _in_unmatched(old[0], old_dirs)):
+					yield DiffItem('deletion', old[1].item_type, old[1].path, old[1].props, None)
+				old = next(old_sorted, None)
+			elif old is None or new[0] < old[0]:
+				if not (skip_children and _in_unmatched(new[0], new_dirs)):
+					yield DiffItem('addition', new[1].item_type, new[1].path, None, new[1].props)
+				new = next(new_sorted, None)
+			else:
+				yield self._diff_matched(old[1], new[1], names_only)
+				old = next(old_sorted, None)
+				new = next(new_sorted, None)
+
+	def _diff_matched(self, old:ListItem, new:ListItem, names_only:bool) -> DiffItem:
+		if (new.item_type == 'file' and not names_only and
+		    not self._files_match(old, new)):
+			return DiffItem('change', new.item_type, new.path, old.props, new.props)
+		return DiffItem('match', new.item_type, new.path, old.props, new.props)
+
+	async def acompare(self, old_list:ty.Union[paths.PathOrStr,ty.TextIO],
+	                   new_list:ty.Union[paths.PathOrStr,ty.TextIO] = '.', *,
+	                   skip_children:bool = False, names_only:bool = True,
+	                   by_path:bool = False, index_size:int = 1000000,
+	                   detect_moves:bool = False, move_window:int = 100000,
+	                   read_ahead:bool = False, tiered:bool = False, batch_size:int = 256,
+	                   executor:ty.Optional[concurrent.futures.Executor] = None
+	                   ) -> ty.AsyncGenerator[DiffItem, None]:
+		gen = self.compare(old_list, new_list,
+		                   skip_children=skip_children, names_only=names_only,
+		                   by_path=by_path, index_size=index_size,
+		                   detect_moves=detect_moves, move_window=move_window,
+		                   read_ahead=read_ahead, tiered=tiered)
+		async for diff_item in filelist._iterate_async(gen, batch_size=batch_size,
+		                                               executor=executor):
+			yield diff_item
+
 	def _get_depth(self, props:format.Props) -> ty.Optional[int]:
 		return props.get_depth(start_level=self.options.start_level, indent=self.options.indent)
 
@@ -94,17 +227,87 @@ class FileListComparer(filelist.FileLister):
 		new_name = new.props.get_name()
 		if old_name is not None and new_name is not None:
 			if self.options.sort_key:
-				# todo: base folder?
-				old_name = self.options.sort_key(paths.PathItem(None, old.path, old_depth or 0, old_isdir))
-				new_name = self.options.sort_key(paths.PathItem(None, new.path, new_depth or 0, new_isdir))
+				old_name = self._get_sort_key(old, old_depth, old_isdir)
+				new_name = self._get_sort_key(new, new_depth, new_isdir)
 			return (new_name < old_name) - (old_name < new_name)
 		return 0
 
+	def _get_sort_key(self, list_item:ListItem, depth:ty.Optional[int], isdir:bool) -> ty.Any:
+		# The current old and new items are compared repeatedly while the
+		# other list catches up, so their keys are kept for the next step
+		for cached_item, key in self._sort_keys:
+			if cached_item is list_item:
+				return key
+		# todo: base folder?
+		key = self.options.sort_key(paths.PathItem(None, list_item.path,
+		                                           depth=depth or 0, isdir=isdir))
+		self._sort_keys = (self._sort_keys[-1], (list_item, key))
+		return key
+
+	def _files_match(self, old:ListItem, new:ListItem) -> bool:
+		if self._live != (None, None):
+			return self._compare_tiered(old, new)
+		return self._compare_files(old.props, new.props)
+
+	def _compare_tiered(self, old:ListItem, new:ListItem) -> bool:
+		# Like _compare_files, but the cheapest properties decide first: a
+		# different size means a change, and the same date a match. Only then
+		# are the hashes of live files computed; a different quick hash means
+		# a change, and the full hash settles it.
+		old_props, new_props = old.props, new.props
+		if 'size' in old_props and 'size' in new_props and \
+		   str(old_props['size']) != str(new_props['size']):
+			return False
+		same_date = None
+		for prop in ('mdate', 'ndate'):
+			if prop in old_props and prop in new_props:
+				same_date = old_props[prop] == new_props[prop]
+				break
+		if same_date:
+			return True
+		if self._has_prop(old, new, 'quickhash') and old_props['quickhash'] != new_props['quickhash']:
+			return False
+		if self._has_prop(old, new, 'hash'):
+			return old_props['hash'] == new_props['hash']
+		return same_date is None
+
+	def _has_prop(self, old:ListItem, new:ListItem, prop:str) -> bool:
+		# Whether both items have the property, computing it for live files if
+		# needed. The value is kept in the item's props for later comparisons.
+		pairs = tuple(zip((old, new), self._live))
+		if any(prop not in list_item.props and (base is None or prop not in self._deferred_props)
+		       for list_item, base in pairs):
+			return False
+		for list_item, base in pairs:
+			if prop not in list_item.props:
+				self._compute_prop(list_item.props, list_item.path, base, prop)
+		return True
+
+	def _compute_prop(self, props:format.Props, path:Path, base:Path, prop:str):
+		item = paths.PathItem(base, path)
+		props[prop] = format.Format._get_property[prop](item, self.options)
+
+	def _hash_unmatched(self, diffs:ty.Iterable[DiffItem]) -> ty.Generator[DiffItem, None, None]:
+		# Moved files are matched on their hashes if the lists have them, so
+		# added or deleted live files need theirs
+		for diff in diffs:
+			if diff.item_type == 'file' and diff.diff_type in _other_side:
+				is_new = diff.diff_type == 'addition'
+				base = self._live[is_new]
+				props = diff.new_props if is_new else diff.old_props
+				if base is not None and 'hash' in self._deferred_props and 'hash' not in props:
+					self._compute_prop(props, diff.path, base, 'hash')
+			yield diff
+
 	def _compare_files(self, old_props:format.Props, new_props:format.Props) -> bool:
 		# Return whether two files match based on their properties
 		if 'hash' in old_props and 'hash' in new_props:
 			return old_props['hash'] == new_props['hash']
-		if 'size' in old_props and 'size' in new_props and old_props['size'] != new_props['size']:
+		if 'quickhash' in old_props and 'quickhash' in new_props and \
+		   old_props['quickhash'] != new_props['quickhash']:
+			return False
+		if 'size' in old_props and 'size' in new_props and \
+		   str(old_props['size']) != str(new_props['size']): # parsed or generated
 			return False
 		if 'mdate' in old_props and 'mdate' in new_props:
 			return old_props['mdate'] == new_props['mdate']
@@ -117,15 +320,285 @@ class FileListComparer(filelist.FileLister):
 		if isinstance(list_or_folder, io.TextIOBase):
 			return self.parse_list(list_or_folder)
 		elif os.path.isdir(list_or_folder):
-			return self.generate(list_or_folder)
+			return self._walk_source(list_or_folder)
 		elif os.path.isfile(list_or_folder):
 			return self.parse_list(list_or_folder)
 		else:
 			raise FileNotFoundError(list_or_folder)
 
+	def _walk_source(self, folder:paths.PathOrStr) -> ty.Generator[ListItem, None, None]:
+		# The sources may be walked at the same time (read_ahead), so each
+		# is counted separately and added to the run's stats when done
+		source_stats = stats.Stats()
+		try:
+			yield from self._generate_folders(folder, source_stats)
+		finally:
+			self.stats._merge(source_stats)
+
+# File properties that read the file contents, and can be left to tiered
+# comparisons to compute for live folders
+_CONTENT_PROPS = frozenset(('hash', 'quickhash'))
+
+def _live_folder(source:ty.Union[paths.PathOrStr,ty.TextIO]) -> ty.Optional[Path]:
+	# Base folder of a source that is walked rather than parsed
+	if isinstance(source, io.TextIOBase) or not os.path.isdir(source):
+		return None
+	return paths._parse_path(source).absolute()
+
+# Item types that are matched by path; closing tags and ellipses have no
+# meaning of their own outside of the list order
+_INDEXED_TYPES = ('file', 'dir')
+
+# (root index, path parts, is folder)
+_PathKey = ty.Tuple[int,ty.Tuple[str,...],bool]
+
+def _keyed(items:ty.Iterable[ListItem]) -> ty.Generator[ty.Tuple[_PathKey,ListItem], None, None]:
+	# Path keys of the items that are matched by path. A list of several
+	# base folders has a root item ('.') for each, and the same relative
+	# paths can occur under each of them, so the keys start with the index
+	# of the root. Sorting by the keys puts folders before their contents.
+	root = -1
+	for item in items:
+		if item.item_type not in _INDEXED_TYPES:
+			continue
+		parts = item.path.parts
+		isdir = item.item_type == 'dir'
+		if isdir and not parts:
+			root += 1
+		yield (root, parts, isdir), item
+
+def _in_unmatched(key:_PathKey, unmatched_dirs:ty.Set[tuple]) -> bool:
+	# Whether an unmatched item is inside an unmatched folder (for skip_children),
+	# given that folders come before their contents
+	root, parts, isdir = key
+	if isdir:
+		unmatched_dirs.add((root, parts))
+	return len(parts) > 0 and (root, parts[:-1]) in unmatched_dirs
+
+def _sort_by_path(items:ty.Iterable[ty.Tuple[_PathKey,ListItem]], run_size:int, *,
+                  batch_size:int = 4096
+                  ) -> ty.Generator[ty.Tuple[_PathKey,ListItem], None, None]:
+	# External sort: items are sorted in runs of run_size, which are written
+	# to temporary files and then merged, so that only one batch per run
+	# is kept in memory
+	import heapq, pickle, tempfile # only needed for lists that don't fit in memory
+	runs = []
+	try:
+		while True:
+			chunk = list(itertools.islice(items, run_size))
+			if not chunk:
+				break
+			chunk.sort(key=operator.itemgetter(0))
+			run = tempfile.TemporaryFile()
+			runs.append(run)
+			for start in range(0, len(chunk), batch_size):
+				pickle.dump(chunk[start:start + batch_size], run, pickle.HIGHEST_PROTOCOL)
+			run.seek(0)
+			del chunk
+		yield from heapq.merge(*map(_read_run, runs), key=operator.itemgetter(0))
+	finally:
+		for run in runs:
+			run.close()
+
+def _read_run(run:ty.BinaryIO) -> ty.Generator[ty.Tuple[tuple,ListItem], None, None]:
+	import pickle
+	while True:
+		try:
+			batch = pickle.load(run)
+		except EOFError:
+			return
+		yield from batch
+
+class _Spool:
+	# Append-only list of items, kept in a temporary file beyond `limit` items
+	def __init__(self, limit:int = 4096):
+		self.limit = limit
+		self._items = []
+		self._file = None
+
+	def append(self, item:ty.Any):
+		self._items.append(item)
+		if len(self._items) >= self.limit:
+			import pickle, tempfile
+			if self._file is None:
+				self._file = tempfile.TemporaryFile()
+			pickle.dump(self._items, self._file, pickle.HIGHEST_PROTOCOL)
+			self._items = []
+
+	def __iter__(self) -> ty.Iterator[ty.Any]:
+		if self._file is not None:
+			self._file.seek(0)
+			yield from _read_run(self._file)
+		yield from self._items
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+		self._items = []
+
+class _Unit:
+	# A deleted or added folder, collected with its contents, and a digest
+	# of their relative paths and file signatures that is independent of
+	# the list order
+	def __init__(self, diff:DiffItem):
+		self.diff = diff
+		self.parts = diff.path.parts
+		self.items = _Spool()
+		self.digest = 0
+		self.files = 0
+
+	def contains(self, parts:ty.Tuple[str,...]) -> bool:
+		return parts[:len(self.parts)] == self.parts
+
+	def add(self, diff:DiffItem):
+		self.items.append(diff)
+		if diff.item_type in _INDEXED_TYPES:
+			entry = (diff.path.parts[len(self.parts):], diff.item_type,
+			         _move_signature(diff) if diff.item_type == 'file' else None)
+			digest = hashlib.blake2b(repr(entry).encode(), digest_size=16).digest()
+			self.digest = (self.digest + int.from_bytes(digest, 'little')) % (1 << 128)
+			self.files += diff.item_type == 'file'
+
+_other_side = {'deletion': 'addition', 'addition': 'deletion'}
+
+class _MoveDetector:
+	# Pairs up deleted and added items into moves. Folders are matched as a
+	# whole once the diff stream has moved past their contents; other files,
+	# or those in folders that weren't matched, by their signatures. At most
+	# `window` folders and files are kept waiting for a match at a time.
+	def __init__(self, window:int):
+		self.window = window
+		self._open = {'deletion': None, 'addition': None}
+		# (kind, side, key) -> waiting Units or DiffItems, oldest first
+		self._waiting = collections.OrderedDict()
+		self._num_waiting = 0
+
+	def run(self, diffs:ty.Iterable[DiffItem]) -> ty.Generator[DiffItem, None, None]:
+		for diff in diffs:
+			yield from self._close_units(diff.path.parts)
+			side = diff.diff_type
+			if side not in _other_side:
+				yield diff
+			elif self._open[side] is not None:
+				self._open[side].add(diff)
+			elif diff.item_type == 'dir' and len(diff.path.parts) > 0:
+				self._open[side] = _Unit(diff)
+			elif diff.item_type == 'file':
+				yield from self._match_file(diff)
+			else:
+				yield diff
+		yield from self._close_units(None)
+		# unmatched folders may still contain moved files
+		for kind in ('dir', 'file'):
+			for key in [key for key in self._waiting if key[0] == kind]:
+				for waiting in self._waiting.pop(key):
+					self._num_waiting -= 1
+					yield from (self._release(waiting) if kind == 'dir' else (waiting,))
+
+	def _close_units(self, parts:ty.Optional[ty.Tuple[str,...]]) -> ty.Generator[DiffItem, None, None]:
+		for side, unit in self._open.items():
+			if unit is not None and (parts is None or not unit.contains(parts)):
+				self._open[side] = None
+				yield from self._match_unit(unit)
+
+	def _match_unit(self, unit:_Unit) -> ty.Generator[DiffItem, None, None]:
+		if unit.files == 0:
+			# empty folders are not worth matching
+			yield from self._release(unit)
+			return
+		side = unit.diff.diff_type
+		other = self._pop_waiting(('dir', _other_side[side], unit.digest))
+		if other is None:
+			self._add_waiting(('dir', side, unit.digest), unit)
+			yield from self._evict()
+			return
+		old, new = (unit, other) if side == 'deletion' else (other, unit)
+		old.items.close()
+		new.items.close()
+		yield DiffItem('move', 'dir', new.diff.path, old.diff.old_props,
+		               new.diff.new_props, old.diff.path)
+
+	def _match_file(self, diff:DiffItem, *, evict:bool = True) -> ty.Generator[DiffItem, None, None]:
+		key = _move_signature(diff)
+		if key is None:
+			yield diff
+			return
+		side = diff.diff_type
+		other = self._pop_waiting(('file', _other_side[side], key))
+		if other is None:
+			self._add_waiting(('file', side, key), diff)
+			if evict:
+				yield from self._evict()
+			return
+		old, new = (diff, other) if side == 'deletion' else (other, diff)
+		yield DiffItem('move', 'file', new.path, old.old_props, new.new_props, old.path)
+
+	def _release(self, unit:_Unit) -> ty.Generator[DiffItem, None, None]:
+		# Give up on matching a folder as a whole
+		yield unit.diff
+		for diff in unit.items:
+			if diff.item_type == 'file':
+				yield from self._match_file(diff, evict=False)
+			else:
+				yield diff
+		unit.items.close()
+
+	def _add_waiting(self, key:tuple, waiting:ty.Union[_Unit,DiffItem]):
+		self._waiting.setdefault(key, []).append(waiting)
+		self._num_waiting += 1
+
+	def _pop_waiting(self, key:tuple) -> ty.Union[_Unit,DiffItem,None]:
+		waiting = self._waiting.get(key)
+		if not waiting:
+			return None
+		self._num_waiting -= 1
+		if len(waiting) == 1:
+			del self._waiting[key]
+		return waiting.pop(0)
+
+	def _evict(self) -> ty.Generator[DiffItem, None, None]:
+		while self._num_waiting > self.window:
+			key, waiting = self._waiting.popitem(last=False)
+			self._num_waiting -= len(waiting)
+			for item in waiting:
+				yield from (self._release(item) if key[0] == 'dir' else (item,))
+
+def _move_signature(diff:DiffItem) -> ty.Optional[tuple]:
+	# (size, hash) if available, or else (size, name)
+	props = diff.old_props if diff.diff_type == 'deletion' else diff.new_props
+	if props is None:
+		return None
+	size = str(props['size']) if 'size' in props else None
+	if props.get('hash'):
+		return ('hash', size, props['hash'])
+	if size is not None:
+		return ('name', size, diff.path.name)
+	return None
+
 def compare(old_list:paths.PathOrStr, new_list:paths.PathOrStr = '.', *,
             skip_children:bool = False, names_only:bool = True,
+            by_path:bool = False, index_size:int = 1000000,
+            detect_moves:bool = False, move_window:int = 100000,
+            read_ahead:bool = False, tiered:bool = False,
             options:ty.Optional[dict] = None) -> ty.Generator[DiffItem, None, None]:
 	yield from FileListComparer(**(options or {})).compare(
 		old_list, new_list,
-		skip_children=skip_children, names_only=names_only)
+		skip_children=skip_children, names_only=names_only,
+		by_path=by_path, index_size=index_size,
+		detect_moves=detect_moves, move_window=move_window,
+		read_ahead=read_ahead, tiered=tiered)
+
+async def acompare(old_list:paths.PathOrStr, new_list:paths.PathOrStr = '.', *,
+                   skip_children:bool = False, names_only:bool = True,
+                   by_path:bool = False, index_size:int = 1000000,
+                   detect_moves:bool = False, move_window:int = 100000,
+                   read_ahead:bool = False, tiered:bool = False,
+                   options:ty.Optional[dict] = None, batch_size:int = 256,
+                   executor:ty.Optional[concurrent.futures.Executor] = None
+                   ) -> ty.AsyncGenerator[DiffItem, None]:
+	async for diff_item in FileListComparer(**(options or {})).acompare(
+			old_list, new_list, skip_children=skip_children, names_only=names_only,
+			by_path=by_path, index_size=index_size,
+			detect_moves=detect_moves, move_window=move_window,
+			read_ahead=read_ahead, tiered=tiered, batch_size=batch_size, executor=executor):
+		yield diff_item
@@ -1,18 +1,28 @@
 from __future__ import annotations
 import collections
+import threading
 import typing as ty
 
-from . import paths
+from . import cache, paths, patterns, stats
 from .config_helpers import (
-	FormatType, DateType, NameType, GroupType, _get_enum, _enum_equals,
-	_SortKey, _group_keys, grouped_sort_key, group_sort_key, join_keys,
-	DEFAULTSORT, GROUPED_DEFAULTSORT)
+	FormatType, DateType, NameType, GroupType, CompressionType, _get_enum, _enum_equals,
+	_SortKey, _group_keys, _grouped_default_keys, grouped_sort_key, group_sort_key,
+	join_keys, DEFAULTSORT, GROUPED_DEFAULTSORT)
 
 class Options:
 	rel_to_cwd      : bool = False
 	append          : bool = False
 	header          : str  = ''
 	footer          : str  = ''
+	save_state      : bool = False
+	compression     : ty.Union[CompressionType,str,None] = None
+	compression_level: ty.Optional[int]                  = None
+	buffer_size     : int                                = 1024*1024
+	parse_workers   : int                                = 0
+
+	progress        : ty.Optional[ty.Callable[[stats.Stats],None]] = None
+	progress_items  : ty.Optional[int]                             = None
+	progress_seconds: ty.Optional[float]                           = 1.0
 
 	file_format     : ty.Optional[str] = None
 	dir_format      : ty.Optional[str] = None
@@ -32,8 +42,11 @@ class Options:
 	show_files      : bool                                            = True
 	filter          : ty.Optional[ty.Callable[[paths.PathItem],bool]] = None
 	filter_hidden   : bool                                            = False
+	include         : ty.Optional[ty.Iterable[patterns.Pattern]]      = None
+	exclude         : ty.Optional[ty.Iterable[patterns.Pattern]]      = None
 	item_grouping   : ty.Union[GroupType,str]                         = GroupType.FILESFIRST
 	sort_key        : ty.Optional[_SortKey]                           = None
+	walk_workers    : int                                             = 0
 
 	name_type       : ty.Union[NameType,str] = NameType.NAME
 	root_name_type  : ty.Union[NameType,str] = NameType.DOT
@@ -42,32 +55,91 @@ class Options:
 	date_type       : ty.Union[DateType,str] = DateType.NEWEST
 	date_format     : str                    = '%Y%m%d%H%M%S'
 	show_hash       : bool                   = False
+	show_quick_hash : bool                   = False
+	hash_algorithm  : str                    = 'sha1'
+	hash_max_size   : ty.Optional[int]       = None
+	quick_hash_size : int                    = 64*1024
+	hash_workers    : int                    = 0
+	audio_workers   : int                    = 0
+	cache_file      : paths.PathOrStr        = None
+	cache_size      : ty.Optional[int]       = 10000000
+	verify_cache    : bool                   = False
 	show_ellipsis   : bool                   = False
 	ellipsis        : str                    = '...'
 	show_hidden     : bool                   = False
 	hidden          : str                    = '*'
 
+	_cache = None # opened FileCache
+	_entry_filter = (None, None) # (options it was compiled from, EntryFilter)
+	_stats = None # Stats of the current run
+
 	def _get_format(self, item_type:str) -> ty.Optional[str]:
 		format_type = _get_enum(FormatType, self.format_type)
 		return _get_format_string[format_type][item_type](self)
 
 	def _get_key(self) -> _SortKey:
-		sort_key = self.sort_key or DEFAULTSORT
-		group_key = _group_keys[_get_enum(GroupType, self.item_grouping)]
-		return join_keys(group_key, sort_key)
+		item_grouping = _get_enum(GroupType, self.item_grouping)
+		if self.sort_key is None:
+			return _grouped_default_keys[item_grouping]
+		return join_keys(_group_keys[item_grouping], self.sort_key)
 
 	def _get_default_extension(self) -> str:
 		if self.format_type and _enum_equals(self.format_type, FormatType.XML):
-			return '.xml'
-		return '.txt'
+			extension = '.xml'
+		elif self.format_type and _enum_equals(self.format_type, FormatType.BINARY):
+			return '.bin'
+		else:
+			extension = '.txt'
+		if self.compression is not None:
+			extension += _compression_extensions[_get_enum(CompressionType, self.compression)]
+		return extension
+
+	def _get_cache(self) -> ty.Optional[cache.FileCache]:
+		# Open the persistent cache on first use
+		if not self.cache_file:
+			return None
+		if self._cache is None:
+			# hash_workers threads may all get here for their first file
+			with _cache_lock:
+				if self._cache is None:
+					self._cache = cache.FileCache(self.cache_file, max_entries=self.cache_size,
+					                              verify=self.verify_cache)
+		return self._cache
+
+	def _close_cache(self):
+		if self._cache is not None:
+			self._cache.close()
+			self._cache = None
+
+	def _get_entry_filter(self) -> ty.Optional[patterns.EntryFilter]:
+		# Filters that only need an entry's name, compiled again when the
+		# options change between runs
+		key = (tuple(self.include or ()), tuple(self.exclude or ()), self.filter_hidden)
+		if self._entry_filter[0] != key:
+			self._entry_filter = (key, patterns.EntryFilter(
+				self.include, self.exclude, hidden=self.filter_hidden and paths.HIDDEN_BY_NAME))
+		return self._entry_filter[1] or None
+
+	def _has_item_filter(self) -> bool:
+		# Whether items need to be checked once they've been created
+		return self.filter is not None or (self.filter_hidden and not paths.HIDDEN_BY_NAME)
 
 	def _is_filtered(self, item:paths.PathItem) -> bool:
-		if self.filter_hidden and item.hidden:
+		if self.filter_hidden and not paths.HIDDEN_BY_NAME and item.hidden:
 			return True
 		if self.filter is not None and self.filter(item):
 			return True
 		return False
 
+_cache_lock = threading.Lock()
+
+_compression_extensions = {
+	CompressionType.NONE: '',
+	CompressionType.GZIP: '.gz',
+	CompressionType.BZ2 : '.bz2',
+	CompressionType.LZMA: '.xz'
+}
+
 ## Format construction
 
 ITEM_TYPES = ['file', 'dir', 'dir_close', 'root', 'ellipsis']
@@ -127,11 +199,12 @@ _get_format_string = {
 				(opt.show_indent, '{indent}'),
 				(True, _get_name_prop(FormatType.PLAIN, opt.name_type)),
 				(opt.show_hidden, '{hidden}'),
-				(opt.show_size or opt.show_date or opt.show_hash,
+				(opt.show_size or opt.show_date or opt.show_hash or opt.show_quick_hash,
 				 ' [' + _toggle_concat(',', [
 					(opt.show_size, '{size}'),
 					(opt.show_date, _get_date_prop(FormatType.PLAIN, opt.date_type)),
-					(opt.show_hash, '{hash}')
+					(opt.show_hash, '{hash}'),
+					(opt.show_quick_hash, '{quickhash}')
 				 ]) + ']'),
 				(True, opt.newline)
 			])),
@@ -173,6 +246,7 @@ _get_format_string = {
 				(opt.show_size, ' size="{size}"'),
 				(opt.show_date, _get_date_prop(FormatType.XML, opt.date_type)),
 				(opt.show_hash, ' hash="{hash}"'),
+				(opt.show_quick_hash, ' quickhash="{quickhash}"'),
 				(True, '/>'),
 				(True, opt.newline)
 			])),
@@ -210,3 +284,6 @@ _get_format_string = {
 			]))
 	}
 }
+# Binary lists are written without format strings; the plain formats are
+# used for generate() and for the properties that are stored
+_get_format_string[FormatType.BINARY] = _get_format_string[FormatType.PLAIN]
@@ -12,6 +12,7 @@ _Enum = ty.TypeVar('Enum', bound=enum.Enum)
 class FormatType(enum.Enum):
 	PLAIN = 0
 	XML = 1
+	BINARY = 2
 
 class DateType(enum.Enum):
 	NEWEST = 0
@@ -29,6 +30,12 @@ class GroupType(enum.Enum):
 	FOLDERSFIRST = 1
 	MIXED = 2
 
+class CompressionType(enum.Enum):
+	NONE = 0
+	GZIP = 1
+	BZ2 = 2
+	LZMA = 3
+
 def _get_enum(enum_:ty.Type[_Enum], value:ty.Union[str,_Enum]) -> _Enum:
 	if isinstance(value, enum_):
 		return value
@@ -55,7 +62,15 @@ _group_keys = {
 }
 
 def join_keys(*keys:ty.Optional[_SortKey]) -> _SortKey:
-	return lambda item: tuple(key(item) for key in keys if key)
+	keys = [key for key in keys if key]
+	# avoid building the tuple through a generator for the common cases
+	if len(keys) == 1:
+		key, = keys
+		return lambda item: (key(item),)
+	if len(keys) == 2:
+		key1, key2 = keys
+		return lambda item: (key1(item), key2(item))
+	return lambda item: tuple([key(item) for key in keys])
 
 def grouped_sort_key(sort_key:ty.Optional[_SortKey] = None,
                      item_grouping:ty.Union[GroupType,str] = GroupType.FILESFIRST
@@ -70,4 +85,12 @@ def group_sort_key(item_grouping:ty.Union[GroupType,str] = GroupType.FILESFIRST
 	return functools.partial(grouped_sort_key, item_grouping=item_grouping)
 
 DEFAULTSORT = lambda item: item.name
-GROUPED_DEFAULTSORT = grouped_sort_key(DEFAULTSORT)
+
+# Equivalent to grouped_sort_key(DEFAULTSORT, item_grouping), without the
+# extra function calls
+_grouped_default_keys = {
+	GroupType.MIXED: lambda item: (item.name,),
+	GroupType.FILESFIRST: lambda item: (item.isdir, item.name),
+	GroupType.FOLDERSFIRST: lambda item: (not item.isdir, item.name)
+}
+GROUPED_DEFAULTSORT = _grouped_default_keys[GroupType.FILESFIRST]
@@ -0,0 +1,91 @@
+from __future__ import annotations
+from datetime import datetime
+import functools
+import re
+import time
+import typing as ty
+
+# Codes that datetime.strftime handles differently from time.strftime
+_DATETIME_CODES = ('%f', '%z', '%Z', '%:')
+# Codes that only depend on the date
+_DATE_CODES = set('aAbBCdDeFgGhjmntuUVwWxyY%')
+# Time-of-day codes that can be filled in arithmetically
+_TIME_CODES = {'H': 0, 'M': 1, 'S': 2}
+
+def _split_date_format(date_format:str) -> ty.Optional[ty.Tuple[str,str]]:
+	# Split a format into a date-only prefix and a suffix that only contains
+	# %H, %M and %S, converted to a %-style template for (hour, minute, second)
+	tokens = [t for t in re.split(r'(%.)', date_format) if t]
+	split = len(tokens)
+	while split > 0 and not (tokens[split - 1].startswith('%') and
+	                         tokens[split - 1][1:] not in _TIME_CODES):
+		split -= 1
+	prefix, suffix = tokens[:split], tokens[split:]
+	if not any(t.startswith('%') and t != '%%' for t in suffix):
+		return None
+	if any(t.startswith('%') and t[1:] not in _DATE_CODES for t in prefix):
+		return None
+	template = ''.join('%(' + t[1] + ')02d' if t.startswith('%') and t != '%%'
+	                   else t.replace('%', '%%') for t in suffix)
+	return ''.join(prefix), template
+
+class DateFormatter:
+	"""Format timestamps like `datetime.fromtimestamp(t).strftime(date_format)`.
+
+	Results are cached per second, as files in the same tree tend to share
+	timestamps. For formats ending in hours, minutes and/or seconds (such as
+	the default), the date part is also cached per day, so that other times
+	on the same day only need some arithmetic."""
+
+	def __init__(self, date_format:str, *, cache_size:int = 65536):
+		self.date_format = date_format
+		self.cache_size = cache_size
+		self._cache = {}
+		stripped = date_format.replace('%%', '')
+		self._fast = not any(code in stripped for code in _DATETIME_CODES)
+		self._split = _split_date_format(date_format) if self._fast else None
+		self._day = (0, 0, '') # start, end, formatted prefix
+
+	def __call__(self, timestamp:float) -> str:
+		if not self._fast:
+			return datetime.fromtimestamp(timestamp).strftime(self.date_format)
+		seconds = int(timestamp)
+		if seconds < 0 or timestamp - seconds >= 0.9999995:
+			# negative, or rounds up to the next second in datetime
+			return datetime.fromtimestamp(timestamp).strftime(self.date_format)
+		result = self._cache.get(seconds)
+		if result is None:
+			if len(self._cache) >= self.cache_size:
+				self._cache.clear()
+			result = self._format(seconds)
+			self._cache[seconds] = result
+		return result
+
+	def _format(self, seconds:int) -> str:
+		if self._split is None:
+			return time.strftime(self.date_format, time.localtime(seconds))
+		start, end, prefix = self._day
+		if not start <= seconds < end:
+			start, end, prefix = self._day = self._get_day(seconds)
+		if start <= seconds < end:
+			minutes, second = divmod(seconds - start, 60)
+			hour, minute = divmod(minutes, 60)
+			return prefix + self._split[1] % {'H': hour, 'M': minute, 'S': second}
+		return time.strftime(self.date_format, time.localtime(seconds))
+
+	def _get_day(self, seconds:int) -> ty.Tuple[int,int,str]:
+		# Local day containing the timestamp, if it has no UTC offset change
+		tm = time.localtime(seconds)
+		start = seconds - (tm.tm_hour*3600 + tm.tm_min*60 + tm.tm_sec)
+		last = time.localtime(start + 86399)
+		if (time.localtime(start).tm_gmtoff != tm.tm_gmtoff or
+		    last.tm_gmtoff != tm.tm_gmtoff or last.tm_yday != tm.tm_yday):
+			return (0, 0, '')
+		return (start, start + 86400, time.strftime(self._split[0], tm))
+
+	def format_many(self, timestamps:ty.Iterable[float]) -> ty.List[str]:
+		return [self(timestamp) for timestamp in timestamps]
+
+@functools.lru_cache(maxsize=32)
+def get_formatter(date_format:str) -> DateFormatter:
+	return DateFormatter(date_format)
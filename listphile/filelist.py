@@ -1,10 +1,17 @@
 from __future__ import annotations
+import functools
 import io
+import itertools
 import os
 from pathlib import Path
+import time
 import typing as ty
 
-from . import config, format, paths
+from . import config_helpers as ch
+from . import binlist, config, format, incremental, lineparse, paths, stats, streams
+
+if ty.TYPE_CHECKING:
+	import concurrent.futures
 
 class ListItem(ty.NamedTuple):
 	item_type:str
@@ -12,11 +19,21 @@ class ListItem(ty.NamedTuple):
 	props:ty.Optional[format.Props] = None
 
 class FileLister:
+	# Functions (lister, events) -> events added by plugins, which compute
+	# their properties ahead of the consumer (see plugins.audio)
+	_prefetchers = []
+	# File properties that generate() leaves out, to be computed later by
+	# the caller if needed (see FileListComparer.compare)
+	_deferred_props = frozenset()
+
 	def __init__(self, **options):
 		self.options = config.Options()
 		self.options.__dict__.update(options)
 		self.set_formats()
 		self._key = None
+		self._previous = None
+		self._state = None
+		self._start_stats()
 
 	def set_formats(self, *, file_format:ty.Optional[str] = None,
 	                dir_format:ty.Optional[str] = None,
@@ -26,6 +43,7 @@ class FileLister:
 		fmt_args = config._Formats(
 			file=file_format, dir=dir_format, dir_close=dir_close_format,
 			root=root_format, ellipsis=ellipsis_format)
+		paths._check_hash_algorithm(self.options.hash_algorithm)
 		for item_type in config.ITEM_TYPES:
 			fmt_attr = item_type + '_format'
 			# Get input argument
@@ -42,42 +60,72 @@ class FileLister:
 			setattr(self, fmt_attr, fmt)
 
 	def dir_function(self, item:paths.PathItem, args:ty.Optional[dict] = None):
-		if item.depth == 0 and self.root_format and \
-		   args and 'file' in args:
-			line = self.root_format.apply(item)
-			args['file'].write(line)
-		elif item.depth > 0 and self.dir_format and \
-		     args and 'file' in args:
-			line = self.dir_format.apply(item)
-			args['file'].write(line)
+		if args and 'binary' in args:
+			args['binary'].add('dir', item)
+			return
+		fmt = self.root_format if item.depth == 0 else self.dir_format
+		if fmt and args and 'file' in args:
+			if fmt.aggregated and isinstance(args['file'], streams.DeferredLines):
+				# written once the folder's contents have been added up
+				item._cache['line_slot'] = args['file'].defer()
+			else:
+				line = fmt.apply(item)
+				self._write_line(args['file'], line)
 
 	def file_function(self, item:paths.PathItem, args:ty.Optional[dict] = None):
+		if args and 'binary' in args:
+			args['binary'].add('file', item)
+			return
 		if self.file_format and args and 'file' in args:
-			line = self.file_format.apply(item)
-			args['file'].write(line)
+			# use properties copied from a previous list if available
+			line = self.file_format.apply(item, **item._cached('props', {}))
+			self._write_line(args['file'], line)
 
 	def ellipsis_function(self, item:paths.PathItem, args:ty.Optional[dict] = None):
+		if args and 'binary' in args:
+			args['binary'].add('ellipsis', item)
+			return
 		if self.ellipsis_format and args and 'file' in args:
 			line = self.ellipsis_format.apply(item)
-			args['file'].write(line)
+			self._write_line(args['file'], line)
 
 	def dir_close_function(self, item:paths.PathItem, args:ty.Optional[dict] = None):
+		if args and 'binary' in args:
+			args['binary'].add('dir_close', item)
+			return
+		slot = item._cached('line_slot')
+		if slot is not None:
+			fmt = self.root_format if item.depth == 0 else self.dir_format
+			args['file'].fill(slot, fmt.apply(item))
+			self.stats.lines_written += 1
 		if self.dir_close_format and args and 'file' in args:
 			line = self.dir_close_format.apply(item)
-			args['file'].write(line)
+			self._write_line(args['file'], line)
+
+	def _write_line(self, file:ty.TextIO, line:str):
+		file.write(line)
+		self.stats.lines_written += 1
 
 	def write_list(self, folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]] = '',
-	               list_path:ty.Union[paths.PathOrStr,ty.TextIO] = ''):
+	               list_path:ty.Union[paths.PathOrStr,ty.TextIO] = '', *,
+	               previous_list:paths.PathOrStr = None):
 		if isinstance(folder, (Path, str, type(None))):
 			base_folders = [folder]
 		else: # sequence
 			base_folders = folder
 
-		if isinstance(list_path, io.TextIOBase):
-			self._write_list(base_folders, list_path)
-			return
-
-		# else, path or string
+		self._start_stats()
+		try:
+			self._write_list_to(base_folders, list_path, previous_list)
+		finally:
+			self.options._close_cache()
+			self._previous = None
+			self._state = None
+			self.stats.end_time = time.perf_counter()
+		self._report_progress()
+
+	def _resolve_list_path(self, list_path:paths.PathOrStr,
+	                       base_folders:ty.Sequence[paths.PathOrStr]) -> Path:
 		list_path = paths._parse_path(list_path)
 		if not list_path.is_absolute():
 			if self.options.rel_to_cwd: # Save location relative to CWD rather than base folder
@@ -86,23 +134,78 @@ class FileLister:
 				list_path = (base_folders[0] / list_path).absolute()
 		if list_path.is_dir():
 			list_path /= 'filelist' + self.options._get_default_extension()
+		return list_path
+
+	def _write_list_to(self, base_folders:ty.Sequence[paths.PathOrStr],
+	                   list_path:ty.Union[paths.PathOrStr,ty.TextIO],
+	                   previous_list:paths.PathOrStr = None):
+		if previous_list:
+			# read the whole list first, as it may be the one being overwritten
+			previous_list = self._resolve_list_path(previous_list, base_folders)
+			self._previous = incremental.PreviousList(self, previous_list) or None
+
+		if isinstance(list_path, io.TextIOBase):
+			if self.options.save_state:
+				raise ValueError('save_state requires a list path rather than a file object')
+			if ch._enum_equals(self.options.format_type, ch.FormatType.BINARY):
+				raise ValueError('binary lists require a list path rather than a file object')
+			self._write_list(base_folders, list_path)
+			return
+
+		# else, path or string
+		list_path = self._resolve_list_path(list_path, base_folders)
+		if self.options.save_state:
+			self._state = incremental.ListState(self)
+
+		if ch._enum_equals(self.options.format_type, ch.FormatType.BINARY):
+			self._write_binary_list(base_folders, list_path)
+		else:
+			self._write_text_list(base_folders, list_path)
+
+		if self._state is not None:
+			self._state.save(list_path)
+
+	def _write_text_list(self, base_folders:ty.Sequence[paths.PathOrStr], list_path:Path):
 
 		list_file = None
 		try:
-			list_file = open(str(list_path), 'a' if self.options.append else 'w', encoding='utf-8')
+			list_file = streams.open_list(list_path, 'a' if self.options.append else 'w',
+				compression=self.options.compression,
+				compression_level=self.options.compression_level,
+				buffer_size=self.options.buffer_size, stats=self.stats)
 			self._write_list(base_folders, list_file)
 
 		finally:
 			if list_file and not list_file.closed:
 				list_file.close()
 
+	def _write_binary_list(self, base_folders:ty.Sequence[paths.PathOrStr], list_path:Path):
+		if self.options.append or self.options.compression is not None:
+			raise ValueError('binary lists cannot be appended to or compressed')
+		if self._previous is not None:
+			raise ValueError('binary lists cannot be updated from a previous list')
+		with open(str(list_path), 'wb', buffering=self.options.buffer_size) as list_file:
+			writer = binlist.Writer(list_file, self)
+			for folder in base_folders:
+				self.run_folder(paths._parse_path(folder).absolute(), args={'binary': writer})
+			writer.finish()
+			self.stats.lines_written += writer._count
+
 	def _write_list(self, folders:ty.Sequence[paths.PathOrStr], file:ty.TextIO):
 		if self.options.header:
 			file.write(self.options.header)
 
-		for folder in folders:
-			abs_folder = paths._parse_path(folder).absolute()
-			self.run_folder(abs_folder, args={'file': file})
+		if any(fmt and fmt.aggregated for fmt in (self.root_format, self.dir_format)):
+			lines = streams.DeferredLines(file)
+		else:
+			lines = file
+		try:
+			for folder in folders:
+				abs_folder = paths._parse_path(folder).absolute()
+				self.run_folder(abs_folder, args={'file': lines})
+		finally:
+			if lines is not file:
+				lines.close()
 
 		if self.options.footer:
 			file.write(self.options.footer)
@@ -115,29 +218,236 @@ class FileLister:
 			assert folder.is_dir()
 			item = paths.PathItem(folder.absolute(), isdir=True)
 			self._key = self.options._get_key()
+			if self._state is not None:
+				self._state.add_root(item)
+
+		functions = {
+			'dir': self.dir_function,
+			'file': self.file_function,
+			'ellipsis': self.ellipsis_function,
+			'dir_close': self.dir_close_function
+		}
+		for item_type, event_item in self._events(item, 'format'):
+			functions[item_type](event_item, args=args)
+
+	def _start_stats(self):
+		self.stats = self.options._stats = stats.Stats()
+
+	def _report_progress(self):
+		if self.options.progress is not None:
+			self.options.progress(self.stats)
+
+	def _events(self, root:paths.PathItem, phase:ty.Optional[str] = None, *,
+	            stats:ty.Optional[stats.Stats] = None
+	            ) -> ty.Generator[ty.Tuple[str,paths.PathItem], None, None]:
+		# The walk's events, with files stat'ed and hashed before they are
+		# passed on, so that those phases can be timed separately. Items are
+		# counted once the consumer is done with them, and the time it takes
+		# is added to `phase`, less any time spent writing the list file.
+		# They're counted in `stats` if given, rather than the run's stats.
+		stats = stats or self.stats
+		times, clock = stats.times, time.perf_counter
+		needs_stat = self._needs_stat() and not self.options.walk_workers
+		hash_jobs = [] if self.options.hash_workers else self._hash_jobs()
+		progress, every, interval = (self.options.progress, self.options.progress_items,
+		                             self.options.progress_seconds)
+		next_count = stats.items + every if every else None
+		next_time = clock() + interval if interval else None
+		consumer_time, write_time = 0.0, times['write']
+		totals = [] if self._aggregated() else None
 
-		self.dir_function(item, args=args)
-
-		if (self.options.max_depth and self.options.max_depth > 0 and
-		    item.depth >= self.options.max_depth):
-			# write ellipsis without visiting folder
-			self.ellipsis_function(item, args=args)
-
-		else:
-			child_items = item.children(self._key)
-			for child_item in child_items:
-				if self.options._is_filtered(child_item):
-					continue
-				if child_item.isdir:
-					self.run_folder(_item=child_item, args=args)
+		try:
+			for event in self._prefetch(self._walk(root)):
+				item_type, item = event
+				if item_type == 'file' and (needs_stat or hash_jobs) and item._cached('props') is None:
+					self._prepare_file(item, needs_stat, hash_jobs, stats)
+				if totals is not None:
+					_add_totals(totals, item_type, item)
+				if phase:
+					start = clock()
+					yield event
+					consumer_time += clock() - start
 				else:
-					self.file_function(child_item, args=args)
+					yield event
+
+				if item_type == 'file':
+					stats.files += 1
+					if item._data is not None:
+						stats.stat_calls += 1
+				elif item_type == 'dir':
+					stats.dirs += 1
+				else:
+					if item_type == 'dir_close' and item._data is not None:
+						stats.stat_calls += 1
+					continue
+				if progress is not None and (
+				   (next_count is not None and stats.items >= next_count) or
+				   (next_time is not None and clock() >= next_time)):
+					if phase:
+						times[phase] += consumer_time - (times['write'] - write_time)
+						consumer_time, write_time = 0.0, times['write']
+					progress(stats)
+					next_count = stats.items + every if every else None
+					next_time = clock() + interval if interval else None
+		finally:
+			if phase:
+				times[phase] += consumer_time - (times['write'] - write_time)
+
+	def _prepare_file(self, item:paths.PathItem, stat:bool,
+	                  hash_jobs:ty.Sequence[ty.Callable[[paths.PathItem],ty.Any]],
+	                  stats:stats.Stats):
+		if stat and item._data is None:
+			start = time.perf_counter()
+			try:
+				item.data
+			except OSError: # raise later, when the item is formatted
+				pass
+			stats.times['stat'] += time.perf_counter() - start
+		for job in hash_jobs:
+			job(item)
+
+	def _walk(self, root:paths.PathItem
+	          ) -> ty.Generator[ty.Tuple[str,paths.PathItem], None, None]:
+		# Depth-first traversal yielding (item_type, PathItem) pairs in list order
+		max_depth = self.options.max_depth
+		if self.options.walk_workers:
+			from . import prefetch
+			reader = prefetch.FolderReader(
+				functools.partial(self._read_folder, stat=self._needs_stat()),
+				workers=self.options.walk_workers,
+				descend=lambda item: not (max_depth and max_depth > 0 and
+				                          item.depth >= max_depth))
+			read_folder = reader.children
+		else:
+			reader = None
+			read_folder = self._read_folder
 
-		self.dir_close_function(item, args=args)
+		stack = []
+		item = root
+		try:
+			while True:
+				if item is not None: # step into folder
+					yield 'dir', item
+					if max_depth and max_depth > 0 and item.depth >= max_depth:
+						# write ellipsis without visiting folder
+						yield 'ellipsis', item
+						children = iter(())
+					else:
+						children = iter(read_folder(item))
+					stack.append((item, children))
+					item = None
+
+				parent, children = stack[-1]
+				for child_item in children:
+					if child_item.isdir:
+						item = child_item
+						break
+					yield 'file', child_item
+				else: # step out
+					stack.pop()
+					yield 'dir_close', parent
+					if not stack:
+						return
+		finally:
+			if reader is not None:
+				reader.close()
+
+	def _read_folder(self, item:paths.PathItem, *, stat:bool = False
+	                 ) -> ty.Iterable[paths.PathItem]:
+		# Sorted and filtered child items, or those copied from a previous list
+		if self._state is not None:
+			self._state.record(item)
+		children = self._previous and self._previous.children(item)
+		reused = children is not None
+		if not reused:
+			entry_filter = self.options._get_entry_filter()
+			start = time.perf_counter()
+			children = item.children(self._key, entry_filter and entry_filter.for_folder(item))
+			self.stats._add_time('read', time.perf_counter() - start)
+			if self.options._has_item_filter():
+				children = [child_item for child_item in children
+				            if not self.options._is_filtered(child_item)]
+		if self._state is not None:
+			self._state.record_count(item, len(children))
+		if reused or not stat:
+			return children
+		children = list(children)
+		start = time.perf_counter()
+		for child_item in children:
+			try:
+				child_item.data
+			except OSError: # raise later, when the item is formatted
+				pass
+		self.stats._add_time('stat', time.perf_counter() - start)
+		return children
+
+	def _aggregated(self) -> bool:
+		# Whether any format uses the totals of a folder's contents
+		return any(fmt and fmt.aggregated
+		           for fmt in (self.dir_format, self.root_format, self.dir_close_format))
+
+	def _needs_stat(self) -> bool:
+		# Whether any format uses file metadata
+		return any(fmt and not fmt.props.isdisjoint(format.STAT_PROPERTIES)
+		           for fmt in (self.file_format, self.dir_format, self.root_format,
+		                       self.dir_close_format, self.ellipsis_format))
+
+	def _prefetch(self, events:ty.Iterable[ty.Tuple[str,paths.PathItem]]
+	              ) -> ty.Iterable[ty.Tuple[str,paths.PathItem]]:
+		# Compute slow file properties in worker threads ahead of the consumer
+		for prefetcher in self._prefetchers:
+			events = prefetcher(self, events)
+		jobs = self._hash_jobs() if self.options.hash_workers else []
+		if not jobs:
+			return events
+		from . import prefetch
+		return prefetch.prefetch(events, jobs, workers=self.options.hash_workers,
+		                         item_types=('file',))
+
+	def _hash_jobs(self) -> ty.List[ty.Callable[[paths.PathItem],ty.Any]]:
+		# Timed getters for the file format's hashes, which cache them on the item
+		jobs = []
+		if self.file_format:
+			for prop in ('hash', 'quickhash'):
+				if prop in self.file_format.props and prop not in self._deferred_props:
+					getter = format.Format._get_property[prop]
+					jobs.append(functools.partial(self._hash_job, getter))
+		return jobs
+
+	def _hash_job(self, getter:ty.Callable[[paths.PathItem,config.Options],str],
+	              item:paths.PathItem):
+		if item._cached('props') is not None: # copied from a previous list
+			return
+		start = time.perf_counter()
+		try:
+			getter(item, self.options)
+		finally:
+			self.stats._add_time('hash', time.perf_counter() - start)
 
 
 	def generate(self, folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]] = ''
 	             ) -> ty.Generator[ListItem, None, None]:
+		self._start_stats()
+		owns_cache = self.options._cache is None # else it's closed by whoever opened it
+		try:
+			yield from self._generate_folders(folder)
+		finally:
+			if owns_cache:
+				self.options._close_cache()
+			self.stats.end_time = time.perf_counter()
+		self._report_progress()
+
+	async def agenerate(self, folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]] = '', *,
+	                    batch_size:int = 256,
+	                    executor:ty.Optional[concurrent.futures.Executor] = None
+	                    ) -> ty.AsyncGenerator[ListItem, None]:
+		async for list_item in _iterate_async(self.generate(folder),
+		                                      batch_size=batch_size, executor=executor):
+			yield list_item
+
+	def _generate_folders(self, folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]],
+	                      stats:ty.Optional[stats.Stats] = None
+	                      ) -> ty.Generator[ListItem, None, None]:
 		if isinstance(folder, (Path, str, type(None))):
 			base_folders = [folder]
 		else: # sequence
@@ -148,94 +458,225 @@ class FileLister:
 			folder = paths._parse_path(folder)
 			assert folder.is_dir()
 			item = paths.PathItem(folder.absolute(), isdir=True)
-			yield from self._generate(item)
+			yield from self._generate(item, stats)
 
-	def _generate(self, item:ty.Optional[paths.PathItem] = None
+	def _generate(self, item:ty.Optional[paths.PathItem] = None,
+	              stats:ty.Optional[stats.Stats] = None
 	              ) -> ty.Generator[ListItem, None, None]:
-		if self.dir_format:
-			props = self.dir_format._get_props(item)
-			yield ListItem('dir', item.path, props)
-
-		if (self.options.max_depth and self.options.max_depth > 0 and
-		    item.depth >= self.options.max_depth):
-			# write ellipsis without visiting folder
-			if self.ellipsis_format:
-				props = self.ellipsis_format._get_props(item)
-				yield ListItem('ellipsis', item.path, props)
-
-		else:
-			child_items = item.children(key=self._key)
-			for child_item in child_items:
-				if self.options._is_filtered(child_item):
-					continue
-				if child_item.isdir:
-					yield from self._generate(child_item)
-				elif self.file_format:
-					props = self.file_format._get_props(child_item)
-					yield ListItem('file', child_item.path, props)
-
-		if self.dir_close_format:
-			props = self.dir_close_format._get_props(item)
-			yield ListItem('dir_close', item.path, props)
-
-	def parse_list(self, list_path:ty.Union[paths.PathOrStr,ty.TextIO]
+		formats = {
+			'dir': self.dir_format,
+			'file': self.file_format,
+			'ellipsis': self.ellipsis_format,
+			'dir_close': self.dir_close_format
+		}
+		if self._deferred_props and self.file_format:
+			formats['file'] = self.file_format._without(self._deferred_props)
+		aggregated = self.dir_format and self.dir_format.aggregated
+		stats = stats or self.stats
+		for item_type, event_item in self._events(item, stats=stats):
+			if aggregated and item_type == 'dir_close':
+				# fill in the totals of the folder's item that was yielded earlier
+				props = event_item._cache.pop('props_out')
+				props.update((prop, format.Format._get_property[prop](event_item, self.options))
+				             for prop in self.dir_format.props & format.AGGREGATE_PROPERTIES)
+			fmt = formats[item_type]
+			if fmt:
+				start = time.perf_counter()
+				props = fmt._get_props(event_item)
+				stats.times['format'] += time.perf_counter() - start
+				if aggregated and item_type == 'dir':
+					event_item._cache['props_out'] = props
+				yield ListItem(item_type, event_item.path, props)
+
+	def parse_list(self, list_path:ty.Union[paths.PathOrStr,ty.TextIO], *,
+	               fields:ty.Optional[ty.Collection[str]] = None,
+	               _on_failure:ty.Optional[ty.Callable[[str],None]] = None
 	               ) -> ty.Generator[ListItem, None, None]:
 		if isinstance(list_path, io.TextIOBase):
-			yield from self._parse_list(list_path)
+			yield from self._parse_list(self._match_lines(list_path), fields, _on_failure)
+		elif not os.path.isfile(list_path):
+			# pipes can only be read once, so they aren't checked for the
+			# binary format or memory-mapped
+			with streams.open_list(list_path, 'r', buffer_size=self.options.buffer_size) as list_file:
+				yield from self._parse_list(self._match_lines(list_file), fields, _on_failure)
+		elif binlist.is_binary_list(list_path):
+			with binlist.BinaryList(list_path, self.options) as binary_list:
+				for list_item in binary_list:
+					yield list_item if fields is None else \
+						list_item._replace(props=_select(list_item.props, fields))
+		elif (streams.detect_compression(list_path) == ch.CompressionType.NONE and
+		      lineparse.is_supported(self)):
+			# match the memory-mapped file without decoding whole lines
+			yield from self._parse_list(lineparse.match_file(
+				list_path, lineparse.get_spec(self, fields),
+				workers=self.options.parse_workers), fields, _on_failure)
 		else:
-			with open(str(list_path), 'r', encoding='utf-8') as list_file:
-				yield from self._parse_list(list_file)
+			with streams.open_list(list_path, 'r', buffer_size=self.options.buffer_size) as list_file:
+				yield from self._parse_list(self._match_lines(list_file), fields, _on_failure)
+
+	def _match_lines(self, list_file:ty.TextIO
+	                 ) -> ty.Generator[ty.Tuple[ty.List[ty.Tuple[str,format.Props]],str], None, None]:
+		# Formats per item type (the root format is a fallback for folders).
+		# Each line is only matched against the formats whose literal prefix
+		# it starts with, e.g. '<Folder' or '</Folder>' for XML.
+		indent = self.options.indent
+		parsers = [(item_type, [(fmt.parse, fmt.prefix, fmt.indented) for fmt in fmts if fmt])
+		           for item_type, fmts in (('dir', (self.dir_format, self.root_format)),
+		                                   ('file', (self.file_format,)),
+		                                   ('dir_close', (self.dir_close_format,)),
+		                                   ('ellipsis', (self.ellipsis_format,)))]
+		parsers = [(item_type, fmts) for item_type, fmts in parsers if fmts]
+		strip = any(indented for _, fmts in parsers for _, _, indented in fmts)
 
-	def _parse_list(self, list_file:ty.TextIO
+		for line in list_file:
+			unindented = format.strip_indent(line, indent) if strip else line
+			matches = []
+			for item_type, fmts in parsers:
+				for parse, prefix, indented in fmts:
+					if (unindented if indented else line).startswith(prefix):
+						pts = parse(line)
+						if pts is not None:
+							matches.append((item_type, pts))
+							break
+			yield matches, line
+
+	def _parse_list(self, matched_lines:ty.Iterable[ty.Tuple[ty.List[ty.Tuple[str,format.Props]],ty.Optional[str]]],
+	                fields:ty.Optional[ty.Collection[str]] = None,
+	                on_failure:ty.Optional[ty.Callable[[str],None]] = None
 	                ) -> ty.Generator[ListItem, None, None]:
 		# todo: match header/footer
 		depth_from_hierarchy = self.dir_format is not None and self.dir_close_format is not None
 		parents = []
 		depth = 0 if depth_from_hierarchy else None
-		for line in list_file:
-			matches = []
-			# folder?
-			pts = self.dir_format and self.dir_format.parse(line)
-			if pts is not None:
-				matches.append(('dir', pts))
-				if depth_from_hierarchy: depth += 1
-			# file?
-			pts = self.file_format and self.file_format.parse(line)
-			if pts is not None:
-				matches.append(('file', pts))
-			# folder close?
-			pts = self.dir_close_format and self.dir_close_format.parse(line)
-			if pts is not None:
-				matches.append(('dir_close', pts))
-				if depth_from_hierarchy: depth -= 1
-			# ellipsis?
-			pts = self.ellipsis_format and self.ellipsis_format.parse(line)
-			if pts is not None:
-				matches.append(('ellipsis', pts))
-
+		depth_change = {'dir': 1, 'dir_close': -1}
+		start_level, indent = self.options.start_level, self.options.indent
+		dir_paths = {}
+
+		for matches, line in matched_lines:
+			if depth_from_hierarchy:
+				for item_type, _ in matches:
+					depth += depth_change.get(item_type, 0)
 			if len(matches) == 0:
-				print(f'Failed to parse line: {line.strip()}')
+				if on_failure is not None:
+					on_failure(line)
+				else:
+					print(f'Failed to parse line: {line.strip()}')
 				continue
 			elif len(matches) > 1:
-				match_types = '/'.join(m[0] for m in matches)
-				print(f'Ambiguous line/format: {line.strip()} ({match_types})')
+				if on_failure is not None:
+					on_failure(line)
+				else:
+					match_types = '/'.join(m[0] for m in matches)
+					print(f'Ambiguous line/format: {line.strip()} ({match_types})')
 
 			item_type, pts = matches[0]
-			full_path = Path(pts.get_path(item_type, parents, depth=depth,
-				start_level=self.options.start_level, indent=self.options.indent))
+			path = pts.get_path(item_type, parents, depth=depth,
+				start_level=start_level, indent=indent)
+			if path is None and on_failure is not None:
+				# no depth information to place the item with
+				on_failure(line)
+				continue
+			# joining onto a known folder is cheaper than parsing the whole path
+			parent, sep, name = path.rpartition(os.sep)
+			parent_path = dir_paths.get(parent) if sep else None
+			full_path = parent_path / name if parent_path is not None else Path(path)
+			if item_type == 'dir':
+				if len(dir_paths) >= 1024:
+					dir_paths.clear()
+				dir_paths[path] = full_path
+			if fields is not None:
+				pts = _select(pts, fields)
 			yield ListItem(item_type, full_path, pts)
 
 
 def write_list(folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]] = '',
                list_path:ty.Union[paths.PathOrStr,ty.TextIO] = '',
-               options:ty.Optional[dict] = None):
-	FileLister(**(options or {})).write_list(folder, list_path)
+               options:ty.Optional[dict] = None, *,
+               previous_list:paths.PathOrStr = None):
+	FileLister(**(options or {})).write_list(folder, list_path, previous_list=previous_list)
 
 def generate(folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]] = '',
              options:ty.Optional[dict] = None
              ) -> ty.Generator[ListItem, None, None]:
 	yield from FileLister(**(options or {})).generate(folder)
 
-def parse_list(list_path:ty.Union[paths.PathOrStr,ty.TextIO], options:ty.Optional[dict] = None
+def parse_list(list_path:ty.Union[paths.PathOrStr,ty.TextIO], options:ty.Optional[dict] = None, *,
+               fields:ty.Optional[ty.Collection[str]] = None
                ) -> ty.Generator[ListItem, None, None]:
-	yield from FileLister(**(options or {})).parse_list(list_path)
+	yield from FileLister(**(options or {})).parse_list(list_path, fields=fields)
+
+async def agenerate(folder:ty.Union[paths.PathOrStr,ty.Sequence[paths.PathOrStr]] = '',
+                    options:ty.Optional[dict] = None, *,
+                    batch_size:int = 256,
+                    executor:ty.Optional[concurrent.futures.Executor] = None
+                    ) -> ty.AsyncGenerator[ListItem, None]:
+	async for list_item in FileLister(**(options or {})).agenerate(
+			folder, batch_size=batch_size, executor=executor):
+		yield list_item
+
+class _Totals:
+	# Contents of a folder and its subfolders, added up while it's listed
+	__slots__ = ('files', 'dirs', 'size', 'mtime')
+
+	def __init__(self):
+		self.files = 0
+		self.dirs = 0
+		self.size = 0
+		self.mtime = None # newest file modification time
+
+	def add(self, other:_Totals):
+		self.files += other.files
+		self.dirs += other.dirs + 1
+		self.size += other.size
+		if other.mtime is not None and (self.mtime is None or other.mtime > self.mtime):
+			self.mtime = other.mtime
+
+def _add_totals(stack:ty.List[_Totals], item_type:str, item:paths.PathItem):
+	# Running totals of the open folders. A folder's are stored on its
+	# item before its dir_close event is passed on.
+	if item_type == 'file':
+		totals = stack[-1]
+		totals.files += 1
+		try:
+			data = item.data
+		except OSError: # raise later, when the item is formatted
+			return
+		totals.size += data.st_size
+		if totals.mtime is None or data.st_mtime > totals.mtime:
+			totals.mtime = data.st_mtime
+	elif item_type == 'dir':
+		stack.append(_Totals())
+	elif item_type == 'dir_close':
+		totals = item._cache['totals'] = stack.pop()
+		if stack:
+			stack[-1].add(totals)
+
+_T = ty.TypeVar('_T')
+
+def _select(props:format.Props, fields:ty.Collection[str]) -> format.Props:
+	return format.Props((prop, value) for prop, value in props.items() if prop in fields)
+
+async def _iterate_async(gen:ty.Generator[_T, None, None], *, batch_size:int = 256,
+                         executor:ty.Optional[concurrent.futures.Executor] = None
+                         ) -> ty.AsyncGenerator[_T, None]:
+	# Advance a blocking generator in an executor, a batch at a time. While
+	# a batch is being consumed, only the next one is read ahead, so a slow
+	# consumer holds up the generator rather than buffering its output.
+	import asyncio # already loaded by the caller's event loop
+	loop = asyncio.get_running_loop()
+	next_batch = lambda: list(itertools.islice(gen, batch_size))
+	pending = loop.run_in_executor(executor, next_batch)
+	try:
+		while True:
+			batch = await pending
+			pending = None
+			if not batch:
+				return
+			pending = loop.run_in_executor(executor, next_batch)
+			for item in batch:
+				yield item
+	finally:
+		if pending is not None:
+			# let the read-ahead finish before closing the generator
+			await asyncio.wait([pending])
+		await loop.run_in_executor(executor, gen.close)
@@ -1,14 +1,16 @@
 from __future__ import annotations
-from datetime import datetime
+import copy
+import functools
+import importlib
 import os
 import re
 import string
 import typing as ty
 
-from . import config, paths
+from . import config, dates, paths
 
-def _fmtdate(date_format:str, time:int) -> str:
-	return datetime.fromtimestamp(time).strftime(date_format)
+def _fmtdate(date_format:str, time:float) -> str:
+	return dates.get_formatter(date_format)(time)
 
 def _date_to_regex(date_format:str) -> str:
 	return re.sub(r'%([A-Za-z%])', lambda m: '\d+?' if m[1] in 'wdmyYHIMSfjUWuV' else '%' if m[1] == '%' else '.+?',
@@ -16,7 +18,14 @@ def _date_to_regex(date_format:str) -> str:
 
 _formatter = string.Formatter()
 
+@functools.lru_cache(maxsize=1024)
+def _indent(indent:str, level:int) -> str:
+	# shared between items, rather than a new string per line
+	return indent*level
+
 class Props(dict):
+	__slots__ = ()
+
 	#def __init__(self, **props):
 	#	super().__init__(self, **props)
 
@@ -66,7 +75,8 @@ class Props(dict):
 				parents[:] = path[:-1]
 			else:
 				parents[:] = path
-			return os.path.join(*path) if len(path) > 0 else ''
+			# names don't contain separators, so they can be joined directly
+			return os.sep.join(path)
 
 			# parent = parents[:(depth - 1)]
 			# if item_type == 'dir': # step in
@@ -76,16 +86,41 @@ class Props(dict):
 				# parents[:] = parent
 			# return os.path.join(*parent, self['name'])
 
+		if (parents is not None and depth is not None and
+		    (item_type in ('dir_close', 'ellipsis') or (item_type == 'dir' and depth == 0))):
+			# Nameless root, closing tag or ellipsis: the folder is known from parents
+			path = parents[:depth]
+			if item_type == 'dir_close':
+				parents[:] = path[:-1]
+			elif item_type == 'dir':
+				parents[:] = path
+			return os.path.join(*path) if len(path) > 0 else ''
+
 		# No name or parents
 		return None
 
 
+# Properties that need an item's stat result
+STAT_PROPERTIES = {'hidden', 'size', 'cdate', 'mdate', 'ndate', 'total_size', 'newest_mdate'}
+# Folder properties that add up the folder's contents, which are only known
+# once it has been listed
+AGGREGATE_PROPERTIES = {'total_size', 'file_count', 'dir_count', 'newest_mdate'}
+
+def _total(item:paths.PathItem, attr:str) -> ty.Any:
+	totals = item._cached('totals')
+	value = getattr(totals, attr) if totals is not None else None
+	return '' if value is None else value
+
+def _newest_mdate(item:paths.PathItem, date_format:str) -> str:
+	mtime = _total(item, 'mtime')
+	return mtime if mtime == '' else _fmtdate(date_format, mtime)
+
 class Format:
 	_get_property = {
-		'indent'  : lambda item, options: options.indent*(item.depth + options.start_level),
+		'indent'  : lambda item, options: _indent(options.indent, item.depth + options.start_level),
 		'level'   : lambda item, options: item.depth + options.start_level,
 		'depth'   : lambda item, options: item.depth,
-		'name'    : lambda item, options: item.abspath.parts[-1],
+		'name'    : lambda item, options: item.name or item.abspath.parts[-1],
 		'relpath' : lambda item, options: str(item.path),
 		'abspath' : lambda item, options: str(item.abspath),
 		'hidden'  : lambda item, options: options.hidden if item.hidden else '',
@@ -93,7 +128,16 @@ class Format:
 		'cdate'   : lambda item, options: _fmtdate(options.date_format, item.data.st_ctime),
 		'mdate'   : lambda item, options: _fmtdate(options.date_format, item.data.st_mtime),
 		'ndate'   : lambda item, options: _fmtdate(options.date_format, max(item.data.st_ctime, item.data.st_mtime)),
-		'hash'    : lambda item, options: item.hash(),
+		'hash'    : lambda item, options: item.hash(
+			algorithm=options.hash_algorithm, max_size=options.hash_max_size,
+			cache=options._get_cache(), stats=options._stats),
+		'quickhash': lambda item, options: item.quick_hash(
+			algorithm=options.hash_algorithm, chunk_size=options.quick_hash_size,
+			cache=options._get_cache(), stats=options._stats),
+		'total_size'  : lambda item, options: _total(item, 'size'),
+		'file_count'  : lambda item, options: _total(item, 'files'),
+		'dir_count'   : lambda item, options: _total(item, 'dirs'),
+		'newest_mdate': lambda item, options: _newest_mdate(item, options.date_format),
 	}
 	_get_regex = {
 		'indent'  : lambda options: '(?:' + re.escape(options.indent) + ')*',
@@ -107,29 +151,72 @@ class Format:
 		'cdate'   : lambda options: _date_to_regex(options.date_format),
 		'mdate'   : lambda options: _date_to_regex(options.date_format),
 		'ndate'   : lambda options: _date_to_regex(options.date_format),
-		'hash'    : lambda options: r'[0-9a-f]+'
+		'hash'    : lambda options: r'[0-9a-f]*',
+		'quickhash': lambda options: r'[0-9a-f]*',
+		'total_size'  : lambda options: r'\d*?',
+		'file_count'  : lambda options: r'\d*?',
+		'dir_count'   : lambda options: r'\d*?',
+		'newest_mdate': lambda options: '(?:' + _date_to_regex(options.date_format) + ')?'
 	}
 
 	def __init__(self, pattern:str, options:config.Options):
 		self.pattern = pattern
 		self._options = options
-		self.props_list = [field[1] for field in _formatter.parse(self.pattern) if field[1] is not None]
-		if any(prop == '' or str.isdecimal(prop) for prop in self.props_list):
-			raise ValueError("positional arguments not supported in format string")
+		self.props_list, template, fields = _compile(pattern)
 
 		self.props = set(self.props_list)
 		if options.properties:
 			self.props |= set(options.properties)
 		for prop in self.props:
-			if prop not in self.__class__._get_property:
+			if prop not in self.__class__._get_property and not _load_plugin(prop):
 				raise ValueError(f'unknown property in pattern: {prop}')
+		self.aggregated = not self.props.isdisjoint(AGGREGATE_PROPERTIES)
+
+		# Getters are looked up once; apply() only evaluates the fields
+		# referenced in the pattern, and fills them in positionally
+		get_property = self.__class__._get_property
+		self._prop_getters = tuple((prop, get_property[prop]) for prop in self.props)
+		getters = tuple(get_property[prop] for prop in fields)
+		format_ = template.format
+		self._render = lambda item: format_(*[getter(item, options) for getter in getters])
+		self._regex = None
+		self._bytes_regex = None
+		self.prefix, self.indented = _get_prefix(pattern, options.indent)
+
+	@property
+	def regex(self) -> re.Pattern:
+		# Only needed for parsing, so compiled on first use
+		if self._regex is None:
+			get_regex = self.__class__._get_regex
+			self._regex = _compile_regex(self.pattern, tuple(
+				(prop, get_regex[prop](self._options))
+				for prop in sorted(set(self.props_list)) if prop in get_regex))
+		return self._regex
 
-		self.regex = re.compile('^' + re.sub(
-			r'\\{(\w*)[^{}]*\\}',
-			lambda m: '(' + (self.__class__._get_regex[m[1]](self._options)
-			          if m[1] in self.__class__._get_regex else '.*?') + ')',
-			re.escape(self.pattern)
-		) + '$')
+	@property
+	def bytes_regex(self) -> re.Pattern:
+		# For matching lines in a bytes buffer from a start to an end position,
+		# without their newline
+		if self._bytes_regex is None:
+			pattern, newline = self.pattern, self._options.newline
+			if newline and pattern.endswith(newline):
+				pattern = pattern[:-len(newline)]
+			get_regex = self.__class__._get_regex
+			regex = _compile_regex(pattern, tuple(
+				(prop, get_regex[prop](self._options))
+				for prop in sorted(set(self.props_list)) if prop in get_regex))
+			self._bytes_regex = re.compile(regex.pattern[1:].encode('utf-8')) # without ^
+		return self._bytes_regex
+
+	@property
+	def bytes_compatible(self) -> bool:
+		# Whether bytes_regex matches the same lines as regex. The built-in
+		# property regexes match the same either way, but those added by
+		# plugins or add_property() may use Unicode-aware classes like \w,
+		# which only match ASCII in bytes regexes.
+		get_regex = self.__class__._get_regex
+		return all(get_regex.get(prop) is _BUILTIN_REGEXES.get(prop)
+		           for prop in self.props_list if prop in get_regex)
 
 	def __repr__(self) -> str:
 		return f'Format({self.pattern!r})'
@@ -139,23 +226,85 @@ class Format:
 
 	def _get_props(self, item:paths.PathItem, **overrides) -> Props:
 		# Get property values, skipping overridden ones
-		props = {k: self.__class__._get_property[k](item, self._options)
-		         for k in self.props - set(overrides.keys())}
-		if overrides:
-			props.update(overrides)
-		return Props(**props)
+		options = self._options
+		if not overrides:
+			return Props({prop: getter(item, options) for prop, getter in self._prop_getters})
+		props = Props({prop: getter(item, options) for prop, getter in self._prop_getters
+		               if prop not in overrides})
+		props.update(overrides)
+		return props
+
+	def _without(self, props:ty.Collection[str]) -> Format:
+		# Copy whose _get_props() leaves out the given properties
+		fmt = copy.copy(self)
+		fmt._prop_getters = tuple((prop, getter) for prop, getter in self._prop_getters
+		                          if prop not in props)
+		return fmt
 
 	def apply(self, item:paths.PathItem, **properties) -> str:
+		if not properties:
+			return self._render(item)
 		props = self._get_props(item, **properties)
 		return self.pattern.format(**props)
 
 	def parse(self, string:str) -> ty.Optional[Props]:
-		pts = re.match(self.regex, string)
+		pts = self.regex.match(string)
 		if pts:
-			return Props(**{self.props_list[i]: val for i,val in enumerate(pts.groups())})
+			return Props(zip(self.props_list, pts.groups()))
 		else:
 			return None
 
+@functools.lru_cache(maxsize=None)
+def _compile(pattern:str) -> ty.Tuple[ty.List[str], str, ty.Tuple[str,...]]:
+	# Split a pattern into its property names, and an equivalent template
+	# that takes the distinct properties as positional arguments
+	props_list = []
+	fields = []
+	template = []
+	for literal, prop, spec, conversion in _formatter.parse(pattern):
+		template.append(literal.replace('{', '{{').replace('}', '}}'))
+		if prop is None:
+			continue
+		if prop == '' or str.isdecimal(prop):
+			raise ValueError("positional arguments not supported in format string")
+		props_list.append(prop)
+		if prop not in fields:
+			fields.append(prop)
+		template.append('{' + str(fields.index(prop)) +
+		                ('!' + conversion if conversion else '') +
+		                (':' + spec if spec else '') + '}')
+	return props_list, ''.join(template), tuple(fields)
+
+@functools.lru_cache(maxsize=256)
+def _get_prefix(pattern:str, indent:str) -> ty.Tuple[str,bool]:
+	# Literal text that every matching line starts with, and whether that
+	# follows an {indent} (in which case leading indents are stripped from it)
+	parsed = list(_formatter.parse(pattern))
+	indented = len(parsed) > 0 and parsed[0][0] == '' and parsed[0][1] == 'indent'
+	if indented:
+		prefix = parsed[1][0] if len(parsed) > 1 else ''
+		return strip_indent(prefix, indent), True
+	return (parsed[0][0] if parsed else ''), False
+
+def strip_indent(line:str, indent:str) -> str:
+	if len(indent) == 1:
+		return line.lstrip(indent)
+	if indent:
+		while line.startswith(indent):
+			line = line[len(indent):]
+	return line
+
+@functools.lru_cache(maxsize=256)
+def _compile_regex(pattern:str, prop_regexes:ty.Tuple[ty.Tuple[str,str],...]) -> re.Pattern:
+	prop_regexes = dict(prop_regexes)
+	return re.compile('^' + re.sub(
+		r'\\{(\w*)[^{}]*\\}',
+		lambda m: '(' + prop_regexes.get(m[1], '.*?') + ')',
+		re.escape(pattern)
+	) + '$')
+
+_BUILTIN_REGEXES = dict(Format._get_regex)
+
 def add_property(key:str, getter:ty.Union[ty.Callable[[paths.PathItem,config.Options],ty.Any],ty.Any] = '',
                  regex:ty.Union[ty.Callable[[config.Options],str],str,None] = r'.*?'):
 	Format._get_property[key] = getter if callable(getter) \
@@ -163,5 +312,45 @@ def add_property(key:str, getter:ty.Union[ty.Callable[[paths.PathItem,config.Opt
 	Format._get_regex[key] = regex if callable(regex) \
 		else lambda options: regex
 
+def add_plugin(properties:ty.Iterable[str], loader:str):
+	"""Register properties that are added by a plugin function, given as
+	'module:function'. The module is only imported when a format first uses
+	one of the properties."""
+	for prop in properties:
+		_plugin_properties[prop] = loader
+
 def list_properties() -> ty.List[str]:
-	return list(Format._get_property.keys())
+	_find_entry_points()
+	return list(Format._get_property.keys()) + \
+		[prop for prop in _plugin_properties if prop not in Format._get_property]
+
+# Properties of plugins that haven't been loaded yet: property -> loader
+_plugin_properties = {}
+# Entry point group for installed packages that add properties; the entry
+# point names are the properties, and the values are their loaders
+ENTRY_POINT_GROUP = 'listphile.properties'
+_entry_points_found = False
+
+def _load_plugin(prop:str) -> bool:
+	# Load the plugin that adds a property, and return whether it was found
+	if prop not in _plugin_properties:
+		_find_entry_points()
+	loader = _plugin_properties.get(prop)
+	if loader is None:
+		return False
+	module, _, function = loader.partition(':')
+	getattr(importlib.import_module(module), function)()
+	for other_prop, other_loader in list(_plugin_properties.items()):
+		if other_loader == loader:
+			del _plugin_properties[other_prop]
+	return prop in Format._get_property
+
+def _find_entry_points():
+	# Only searched when a property isn't known otherwise, as it's slow
+	global _entry_points_found
+	if _entry_points_found:
+		return
+	_entry_points_found = True
+	from importlib import metadata
+	for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP):
+		_plugin_properties.setdefault(entry_point.name, entry_point.value)
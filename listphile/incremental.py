@@ -0,0 +1,159 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import typing as ty
+
+from . import config_helpers as ch
+from . import paths, patterns
+
+if ty.TYPE_CHECKING:
+	from . import filelist, format
+
+_STATE_VERSION = 2
+
+def state_path(list_path:paths.PathOrStr) -> Path:
+	# Sidecar file next to a list
+	list_path = paths._parse_path(list_path)
+	return list_path.with_name(list_path.name + '.state')
+
+def _signature(lister:filelist.FileLister) -> dict:
+	# Options that need to match for a previous list's lines to be reusable
+	opt = lister.options
+	return {
+		'formats': [getattr(lister, item_type + '_format') and
+		            getattr(lister, item_type + '_format').pattern
+		            for item_type in ('file', 'dir', 'dir_close', 'root', 'ellipsis')],
+		'indent': opt.indent,
+		'max_depth': opt.max_depth,
+		'item_grouping': ch._get_enum(ch.GroupType, opt.item_grouping).name,
+		'sort_key': opt.sort_key is not None,
+		'filter_hidden': opt.filter_hidden,
+		'include': [patterns.describe(pattern) for pattern in opt.include or ()],
+		'exclude': [patterns.describe(pattern) for pattern in opt.exclude or ()],
+		# these change how the properties are written
+		'date_format': opt.date_format,
+		'hash_algorithm': opt.hash_algorithm,
+		'hash_max_size': opt.hash_max_size,
+		'quick_hash_size': opt.quick_hash_size,
+		'hidden': opt.hidden
+	}
+
+class ListState:
+	"""Directory modification times and entry counts recorded while
+	writing a list."""
+
+	def __init__(self, lister:filelist.FileLister):
+		self.signature = _signature(lister)
+		self.roots = []
+		self.mtimes = {}
+		self.counts = {}
+
+	def add_root(self, item:paths.PathItem):
+		self.roots.append(str(item.basefolder))
+
+	def record(self, item:paths.PathItem):
+		# Called before reading a folder, so that changes during the
+		# listing are picked up next time
+		try:
+			self.mtimes[item._fspath] = item.data.st_mtime_ns
+		except OSError:
+			pass
+
+	def record_count(self, item:paths.PathItem, count:int):
+		# Number of entries listed in a folder, to check the previous list
+		# against before copying them
+		self.counts[item._fspath] = count
+
+	def save(self, list_path:paths.PathOrStr):
+		with open(str(state_path(list_path)), 'w', encoding='utf-8') as file:
+			json.dump({
+				'version': _STATE_VERSION,
+				'signature': self.signature,
+				'roots': self.roots,
+				'mtimes': self.mtimes,
+				'counts': self.counts
+			}, file)
+
+	@staticmethod
+	def load(list_path:paths.PathOrStr) -> ty.Optional[dict]:
+		try:
+			with open(str(state_path(list_path)), 'r', encoding='utf-8') as file:
+				state = json.load(file)
+		except FileNotFoundError:
+			return None
+		if state.get('version') != _STATE_VERSION:
+			return None
+		return state
+
+class _Entry(ty.NamedTuple):
+	name:str
+	isdir:bool
+	props:ty.Optional[format.Props]
+
+class PreviousList:
+	"""The contents of a previous list, for copying the entries of folders
+	that haven't changed since. A folder's entries are reused if its
+	modification time matches the one recorded in the list's state file,
+	which means no files were added, removed or renamed in it, and the
+	number of its entries in the list matches the recorded one. If any
+	line of the previous list can't be parsed, nothing is reused. Neither
+	is anything with a `filter` callable, as its results can't be
+	compared between runs. Note that this doesn't detect files being
+	modified in place."""
+
+	def __init__(self, lister:filelist.FileLister, list_path:paths.PathOrStr):
+		self._mtimes = {}
+		self._counts = {}
+		self._trees = {}
+		if lister.options.filter is not None:
+			return
+		state = ListState.load(list_path)
+		if state is None or state['signature'] != _signature(lister):
+			return
+
+		failed = []
+		trees = []
+		for list_item in lister.parse_list(list_path, _on_failure=failed.append):
+			if list_item.item_type == 'dir' and str(list_item.path) == '.':
+				trees.append({'.': []})
+				continue
+			if not trees or list_item.item_type not in ('file', 'dir'):
+				continue
+			isdir = list_item.item_type == 'dir'
+			tree = trees[-1]
+			tree.setdefault(str(list_item.path.parent), []).append(
+				_Entry(list_item.path.name, isdir, None if isdir else list_item.props))
+			if isdir:
+				tree.setdefault(str(list_item.path), [])
+		if failed:
+			print(f'Not reusing {list_path}: {len(failed)} line(s) could not be parsed')
+			return
+		self._mtimes = state['mtimes']
+		self._counts = state['counts']
+		self._trees = dict(zip(state['roots'], trees))
+
+	def __bool__(self) -> bool:
+		return bool(self._trees)
+
+	def children(self, item:paths.PathItem) -> ty.Optional[ty.List[paths.PathItem]]:
+		# Previous child items if the folder is unchanged, otherwise None
+		tree = self._trees.get(str(item.basefolder))
+		if tree is None:
+			return None
+		entries = tree.get(str(item.path))
+		mtime = self._mtimes.get(item._fspath)
+		if entries is None or mtime is None or len(entries) != self._counts.get(item._fspath):
+			return None
+		try:
+			if item.data.st_mtime_ns != mtime:
+				return None
+		except OSError:
+			return None
+
+		child_items = []
+		for entry in entries:
+			child_item = item._child(entry.name, entry.isdir)
+			if entry.props is not None:
+				child_item._cache['props'] = entry.props
+			child_items.append(child_item)
+		return child_items
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import functools
+import mmap
+import os
+import re
+import typing as ty
+
+from . import format, paths
+
+if ty.TYPE_CHECKING:
+	from . import filelist
+
+# Matching lines straight from a memory-mapped list file, using bytes
+# versions of the formats' regexes. Lines are never decoded as a whole;
+# only the properties that are needed are.
+
+# A picklable description of the formats, so that it can be sent to
+# worker processes: (indent, [(item_type, [(regex, prefix, indented,
+# [(prop, group)])])]), where the regexes and prefixes are bytes
+_Spec = ty.Tuple[bytes, ty.List[ty.Tuple[str, ty.List[ty.Tuple[bytes,bytes,bool,ty.List[ty.Tuple[str,int]]]]]]]
+# ([(item_type, props)], line), where the line is only included if it
+# didn't match exactly one format
+_Match = ty.Tuple[ty.List[ty.Tuple[str,format.Props]], ty.Optional[str]]
+
+# Properties needed for reconstructing the item paths
+PATH_PROPERTIES = {'indent', 'level', 'depth', 'name', 'relpath'}
+
+def is_supported(lister:filelist.FileLister) -> bool:
+	# Whether the lister's formats can be matched as bytes
+	return all(fmt.bytes_compatible for fmt in (
+		lister.dir_format, lister.root_format, lister.file_format,
+		lister.dir_close_format, lister.ellipsis_format) if fmt)
+
+def get_spec(lister:filelist.FileLister, fields:ty.Optional[ty.Collection[str]] = None) -> _Spec:
+	indent = lister.options.indent.encode('utf-8')
+	parsers = []
+	for item_type, fmts in (('dir', (lister.dir_format, lister.root_format)),
+	                        ('file', (lister.file_format,)),
+	                        ('dir_close', (lister.dir_close_format,)),
+	                        ('ellipsis', (lister.ellipsis_format,))):
+		specs = []
+		for fmt in fmts:
+			if not fmt:
+				continue
+			# later groups for the same property take precedence, like in Format.parse()
+			groups = {prop: i for i, prop in enumerate(fmt.props_list, start=1)
+			          if fields is None or prop in fields or prop in PATH_PROPERTIES}
+			# lines are matched without their newline
+			prefix, newline = fmt.prefix, lister.options.newline
+			if newline and prefix.endswith(newline):
+				prefix = prefix[:-len(newline)]
+			specs.append((fmt.bytes_regex.pattern, prefix.encode('utf-8'), fmt.indented,
+			              list(groups.items())))
+		if specs:
+			parsers.append((item_type, specs))
+	return indent, parsers
+
+@functools.lru_cache(maxsize=None)
+def _compile(spec:_Spec) -> ty.Tuple[ty.Callable[[bytes,int,int],int], list]:
+	# Compiled regexes for a spec (cached per process)
+	indent, parsers = spec
+	needs_indent = any(prefix and indented for _, specs in parsers for _, prefix, indented, _ in specs)
+	skip_indent = (re.compile(b'(?:' + re.escape(indent) + b')*').match
+	               if indent and needs_indent else None)
+	return skip_indent, [(item_type, [(re.compile(regex).match, prefix, len(prefix), indented,
+	                                   tuple(prop for prop, _ in groups),
+	                                   tuple(group for _, group in groups) or (0,))
+	                                  for regex, prefix, indented, groups in specs])
+	                     for item_type, specs in parsers]
+
+def _freeze(spec:_Spec) -> _Spec:
+	# Hashable version of a spec, for caching
+	indent, parsers = spec
+	return indent, tuple((item_type, tuple((regex, prefix, indented, tuple(groups))
+	                                        for regex, prefix, indented, groups in specs))
+	                     for item_type, specs in parsers)
+
+def match_lines(buffer:ty.Union[bytes,mmap.mmap], spec:_Spec, start:int = 0,
+                end:ty.Optional[int] = None) -> ty.Generator[_Match, None, None]:
+	"""Match the lines in buffer[start:end] against the formats in a spec."""
+	skip_indent, parsers = _compile(_freeze(spec))
+	end = len(buffer) if end is None else end
+	find = buffer.find
+	Props = format.Props
+	decode = bytes.decode
+	pos = start
+	while pos < end:
+		line_end = find(b'\n', pos, end)
+		next_pos = end if line_end < 0 else line_end + 1
+		if line_end < 0:
+			line_end = end
+		if line_end > pos and buffer[line_end - 1] == 13: # \r\n
+			line_end -= 1
+		unindented = skip_indent(buffer, pos, line_end).end() if skip_indent else pos
+
+		matches = []
+		for item_type, fmts in parsers:
+			for match, prefix, prefix_length, indented, props, groups in fmts:
+				if prefix_length:
+					offset = unindented if indented else pos
+					if buffer[offset:offset + prefix_length] != prefix:
+						continue
+				m = match(buffer, pos, line_end)
+				if m is not None:
+					values = m.group(*groups)
+					if len(groups) == 1:
+						values = (values,)
+					matches.append((item_type, Props(zip(props, map(decode, values)))))
+					break
+		yield matches, (None if len(matches) == 1 else
+		                str(buffer[pos:line_end], 'utf-8', 'replace'))
+		pos = next_pos
+
+def _match_chunk(path:str, spec:_Spec, start:int, end:int) -> ty.List[_Match]:
+	# Worker process function
+	with open(path, 'rb') as file:
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+			return list(match_lines(buffer, spec, start, end))
+
+def split_lines(buffer:ty.Union[bytes,mmap.mmap], chunk_size:int) -> ty.List[ty.Tuple[int,int]]:
+	"""Split a buffer into (start, end) ranges of about chunk_size bytes,
+	at line boundaries."""
+	chunks = []
+	start = 0
+	while start < len(buffer):
+		end = buffer.find(b'\n', min(start + chunk_size, len(buffer)) - 1)
+		end = len(buffer) if end < 0 else end + 1
+		chunks.append((start, end))
+		start = end
+	return chunks
+
+def match_file(path:paths.PathOrStr, spec:_Spec, *, workers:int = 0,
+               chunk_size:int = 4*1024*1024) -> ty.Generator[_Match, None, None]:
+	"""Match the lines of an (uncompressed) list file, optionally splitting
+	it into chunks that are matched by `workers` processes."""
+	path = os.fspath(path)
+	with open(path, 'rb') as file:
+		if os.fstat(file.fileno()).st_size == 0:
+			return
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+			if not workers:
+				yield from match_lines(buffer, spec)
+				return
+			chunks = split_lines(buffer, chunk_size)
+
+	import collections
+	from . import prefetch
+	with prefetch.process_pool(workers) as executor:
+		# keep a few chunks in progress ahead of the consumer
+		pending = collections.deque()
+		chunks = iter(chunks)
+		try:
+			for start, end in chunks:
+				pending.append(executor.submit(_match_chunk, path, spec, start, end))
+				if len(pending) >= 2*workers:
+					yield from pending.popleft().result()
+			while pending:
+				yield from pending.popleft().result()
+		finally:
+			for future in pending:
+				future.cancel()
@@ -7,6 +7,13 @@ import typing as ty
 
 from . import config_helpers as ch
 
+if ty.TYPE_CHECKING:
+	from . import cache as _cache, stats as _stats
+
+# Without file attributes (i.e. other than on Windows), names starting
+# with a dot are hidden
+HIDDEN_BY_NAME = not hasattr(os.stat_result, 'st_file_attributes')
+
 PathOrStr = ty.Union[Path, str, None]
 def _parse_path(path:PathOrStr) -> Path:
 	if not path:
@@ -15,45 +22,155 @@ def _parse_path(path:PathOrStr) -> Path:
 		return path
 	return Path(path)
 
+def _check_hash_algorithm(algorithm:str):
+	# Raise before a list is written rather than at the first file hashed.
+	# Variable-length digests (shake_*) aren't supported.
+	if not hashlib.new(algorithm).digest_size:
+		raise ValueError(f'hash algorithm without a fixed digest size: {algorithm}')
+
 class PathItem:
+	# Children refer to their parent folder instead of holding their own
+	# paths, which are only built when asked for
+	__slots__ = ('basefolder', 'depth', 'isdir', '_parent', '_name', '_path',
+	             '_entry', '_data', '_values')
+
 	def __init__(self, basefolder:ty.Optional[Path] = None, path:ty.Optional[Path] = None,
-	             *, depth:int = 0, isdir:bool = False):
+	             *, depth:int = 0, isdir:bool = False, entry:ty.Optional[os.DirEntry] = None,
+	             _parent:ty.Optional[PathItem] = None, _name:ty.Optional[str] = None):
 		self.basefolder = basefolder or Path('').absolute()
-		self.path = path or Path('')
 		self.depth = depth
 		self.isdir = isdir
-		self._cache = {}
+		self._parent = _parent
+		self._name = _name
+		self._path = path if _parent is None else None
+		if self._path is None and _parent is None:
+			self._path = Path('')
+		self._entry = entry
+		self._data = None
+		self._values = None
 
 	@property
 	def name(self) -> str:
+		if self._name is not None:
+			return self._name
 		return self.path.name or self.basefolder.name
 
+	@property
+	def path(self) -> Path:
+		# Relative path, built from the parent's on first use
+		if self._path is None:
+			self._path = self._parent.path / self._name
+		return self._path
+
+	@path.setter
+	def path(self, path:Path):
+		self._path = path
+
 	@property
 	def abspath(self) -> Path:
 		return self.basefolder / self.path
 
+	@property
+	def _fspath(self) -> str:
+		# absolute path string, reusing the scandir entry's path if available
+		if self._entry is not None:
+			return self._entry.path
+		return str(self.abspath)
+
+	@property
+	def _cache(self) -> dict:
+		# Memoized values (hashes, plugin data, etc.), allocated on first use
+		if self._values is None:
+			self._values = {}
+		return self._values
+
+	def _cached(self, key:ty.Any, default:ty.Any = None) -> ty.Any:
+		# Look up a memoized value without allocating the dict
+		return default if self._values is None else self._values.get(key, default)
+
 	@property
 	def data(self) -> os.stat_result:
-		if self._cache.get('data', None) is None:
-			self._cache['data'] = self.abspath.stat()
-		return self._cache['data']
+		if self._data is None:
+			# DirEntry.stat() is cached by the entry itself, and free on Windows
+			self._data = (self._entry.stat() if self._entry is not None
+			              else self.abspath.stat())
+		return self._data
+
+	def _isfile(self) -> bool:
+		if self._entry is not None:
+			return self._entry.is_file()
+		return self.abspath.is_file()
 
 	@property
 	def hidden(self) -> bool:
+		if HIDDEN_BY_NAME:
+			return self.name.startswith('.')
 		# https://stackoverfllow.com/questions/284115/cross-platform-hidden-file-detection
 		return bool(self.data.st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
 
-	def hash(self, *, buffer_size:int = 1024*1024, max_size:ty.Optional[int] = None) -> str:
-		if self.abspath.is_file() and (not max_size or max_size <= self.data.st_size):
-			hasher = hashlib.sha1()
-			with open(self.abspath, 'rb') as file:
-				while True:
-					buf = file.read(buffer_size)
-					if not buf: break
-					hasher.update(buf)
-			return hasher.hexdigest()
-		else:
+	def hash(self, *, algorithm:str = 'sha1', buffer_size:int = 1024*1024,
+	         max_size:ty.Optional[int] = None,
+	         cache:ty.Optional[_cache.FileCache] = None,
+	         stats:ty.Optional[_stats.Stats] = None) -> str:
+		if max_size and self.data.st_size > max_size:
 			return ''
+		key = ('hash', algorithm)
+		if key not in self._cache:
+			if not self._isfile():
+				digest = ''
+			elif cache is not None:
+				digest = cache.fetch(self, algorithm,
+				                     lambda: self._hash_file(algorithm, buffer_size, stats))
+			else:
+				digest = self._hash_file(algorithm, buffer_size, stats)
+			self._cache[key] = digest
+		return self._cache[key]
+
+	def quick_hash(self, *, algorithm:str = 'sha1', chunk_size:int = 64*1024,
+	               cache:ty.Optional[_cache.FileCache] = None,
+	               stats:ty.Optional[_stats.Stats] = None) -> str:
+		key = ('quick_hash', algorithm, chunk_size)
+		if key not in self._cache:
+			if not self._isfile():
+				digest = ''
+			elif cache is not None:
+				digest = cache.fetch(self, f'quick-{algorithm}-{chunk_size}',
+				                     lambda: self._quick_hash_file(algorithm, chunk_size, stats))
+			else:
+				digest = self._quick_hash_file(algorithm, chunk_size, stats)
+			self._cache[key] = digest
+		return self._cache[key]
+
+	def _hash_file(self, algorithm:str, buffer_size:int,
+	               stats:ty.Optional[_stats.Stats] = None) -> str:
+		hasher = hashlib.new(algorithm)
+		size = 0
+		with open(self._fspath, 'rb') as file:
+			while True:
+				buf = file.read(buffer_size)
+				if not buf: break
+				hasher.update(buf)
+				size += len(buf)
+		if stats is not None:
+			stats._add_hashed(size)
+		return hasher.hexdigest()
+
+	def _quick_hash_file(self, algorithm:str, chunk_size:int,
+	                     stats:ty.Optional[_stats.Stats] = None) -> str:
+		# Digest of the size and the first, middle and last chunks
+		size = self.data.st_size
+		hasher = hashlib.new(algorithm)
+		hasher.update(size.to_bytes(8, 'little'))
+		with open(self._fspath, 'rb') as file:
+			if size <= 3*chunk_size:
+				hasher.update(file.read())
+			else:
+				for offset in (0, (size - chunk_size)//2, size - chunk_size):
+					file.seek(offset)
+					hasher.update(file.read(chunk_size))
+		if stats is not None:
+			stats._add_hashed(min(size, 3*chunk_size))
+		return hasher.hexdigest()
 
 	def get_name(self, name_type:ty.Union[ch.NameType,str] = ch.NameType.NAME) -> str:
 		if ch._enum_equals(name_type, ch.NameType.DOT):
@@ -67,19 +184,31 @@ class PathItem:
 		else:
 			raise ValueError(f'unknown NameType value: {name_type}')
 
-	def _child(self, name:str, isdir:bool = False) -> PathItem:
-		return PathItem(self.basefolder, self.path / name, depth=self.depth + 1, isdir=isdir)
+	def _child(self, name:str, isdir:bool = False,
+	           entry:ty.Optional[os.DirEntry] = None) -> PathItem:
+		return PathItem(self.basefolder, depth=self.depth + 1, isdir=isdir, entry=entry,
+		                _parent=self, _name=name)
 
-	def iterdir(self) -> ty.Generator[PathItem,None,None]:
-		if self.abspath.is_dir():
-			try:
-				for child in self.abspath.iterdir():
-					yield self._child(child.name, child.is_dir())
-			except PermissionError: # system directory
-				pass
+	def iterdir(self, skip:ty.Optional[ty.Callable[[str,bool],bool]] = None
+	            ) -> ty.Generator[PathItem,None,None]:
+		# One directory read; the entries' file types come from the same call.
+		# Entries for which skip(name, isdir) is true are left out before
+		# creating their items.
+		try:
+			with os.scandir(self._fspath) as entries:
+				for entry in entries:
+					isdir = entry.is_dir()
+					if skip is not None and skip(entry.name, isdir):
+						continue
+					yield self._child(entry.name, isdir, entry)
+		except (NotADirectoryError, FileNotFoundError): # not a folder
+			pass
+		except PermissionError: # system directory
+			pass
 
-	def children(self, key:ty.Optional[ch._SortKey] = None) -> ty.List[PathItem]:
+	def children(self, key:ty.Optional[ch._SortKey] = None,
+	             skip:ty.Optional[ty.Callable[[str,bool],bool]] = None) -> ty.List[PathItem]:
 		if not key: key = ch.GROUPED_DEFAULTSORT
-		items = list(self.iterdir())
+		items = list(self.iterdir(skip))
 		items.sort(key=key)
 		return items
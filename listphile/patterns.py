@@ -0,0 +1,143 @@
+from __future__ import annotations
+import os
+import re
+import typing as ty
+
+from . import paths
+
+Pattern = ty.Union[str, re.Pattern]
+# Whether a directory entry is skipped, given its name and whether it's a folder
+_Skip = ty.Callable[[str,bool],bool]
+
+def glob_to_regex(glob:str) -> str:
+	"""Translate a gitignore-style glob to a regular expression for relative
+	paths with '/' separators. `*` and `?` don't match a '/', `**` matches
+	any number of folders, and `[...]` matches a character class."""
+	parts = []
+	i, n = 0, len(glob)
+	while i < n:
+		c = glob[i]
+		if glob.startswith('**/', i):
+			parts.append('(?:.*/)?')
+			i += 3
+			continue
+		if glob.startswith('**', i):
+			parts.append('.*')
+			i += 2
+			continue
+		if c == '*':
+			parts.append('[^/]*')
+		elif c == '?':
+			parts.append('[^/]')
+		elif c == '[':
+			# a ']' right after the opening bracket (or '!') is literal
+			start = i + 2 if glob.startswith(('[!', '[^'), i) else i + 1
+			end = glob.find(']', start + 1)
+			if end < 0:
+				parts.append(re.escape(c))
+			else:
+				chars = glob[start:end].replace('\\', '\\\\').replace('[', '\\[')
+				parts.append(('[^' if start == i + 2 else '[') + chars + ']')
+				i = end
+		else:
+			parts.append(re.escape(c))
+		i += 1
+	return ''.join(parts)
+
+class EntryFilter:
+	"""Include and exclude patterns, compiled once and matched against the
+	names of directory entries before they are turned into PathItems.
+
+	Globs without a '/' match an entry's name at any depth; other globs
+	match its path relative to the base folder (a leading '/' is ignored).
+	A trailing '/' restricts a glob to folders. Regular expressions
+	(compiled `re.Pattern`s) must match the whole relative path, which
+	ends in '/' for folders. Excluded folders aren't entered. Include
+	patterns only apply to files: if there are any, files that match none
+	of them are skipped. With `hidden`, names starting with '.' are
+	skipped as well."""
+
+	def __init__(self, include:ty.Iterable[Pattern] = (), exclude:ty.Iterable[Pattern] = (), *,
+	             hidden:bool = False):
+		self.include = list(include or ())
+		self.exclude = list(exclude or ())
+		self.hidden = hidden
+		# [file, folder] -> a combined regex for names, and regexes for
+		# relative paths
+		self._exclude_names, self._exclude_paths = _compile(self.exclude)
+		self._include_names, self._include_paths = _compile(self.include)
+		self._has_include = bool(self.include)
+
+	def __bool__(self) -> bool:
+		return bool(self.include or self.exclude or self.hidden)
+
+	def for_folder(self, folder:paths.PathItem) -> _Skip:
+		# The path patterns are matched against the folder's relative path
+		# joined with the entry name, so it's only converted once per folder
+		prefix = folder.path.as_posix() + '/' if folder.path.parts else ''
+		hidden = self.hidden
+		exclude_names, exclude_paths = self._exclude_names, self._exclude_paths
+		include_names, include_paths = self._include_names, self._include_paths
+		has_include = self._has_include
+
+		def skip(name:str, isdir:bool) -> bool:
+			if hidden and name[0] == '.':
+				return True
+			match = exclude_names[isdir]
+			if match is not None and match(name):
+				return True
+			matches = exclude_paths[isdir]
+			if matches:
+				path = prefix + name + '/' if isdir else prefix + name
+				if any(match(path) for match in matches):
+					return True
+			if has_include and not isdir:
+				match = include_names[False]
+				if match is not None and match(name):
+					return False
+				path = prefix + name
+				return not any(match(path) for match in include_paths[False])
+			return False
+		return skip
+
+def describe(pattern:Pattern) -> str:
+	# JSON-compatible form of a pattern, for checking whether two runs match
+	return pattern if isinstance(pattern, str) else 're:' + pattern.pattern
+
+def _compile(patterns:ty.Iterable[Pattern]) -> ty.Tuple[list,list]:
+	# Sort the patterns by what they match: [for files, for folders] for
+	# names and for paths. The globs of each group are joined into a single
+	# regex; regexes are kept as they are, as they may have their own flags.
+	names = ([], [])
+	path_globs = ([], [])
+	path_regexes = []
+	for pattern in patterns:
+		if isinstance(pattern, re.Pattern):
+			# only folder paths end in '/', so the regex sorts that out itself
+			path_regexes.append(pattern.fullmatch)
+			continue
+		glob = pattern.replace(os.sep, '/') if os.sep != '/' else pattern
+		dirs_only = glob.endswith('/')
+		glob = glob.rstrip('/')
+		if not glob:
+			continue
+		if '/' in glob:
+			# folder paths end in '/'
+			regex = glob_to_regex(glob.lstrip('/')) + ('/' if dirs_only else '/?')
+			groups = path_globs
+		else:
+			regex = glob_to_regex(glob)
+			groups = names
+		for isdir, group in enumerate(groups):
+			if isdir or not dirs_only:
+				group.append(regex)
+	path_matchers = []
+	for group in path_globs:
+		joined = _join(group)
+		path_matchers.append(((joined,) if joined else ()) + tuple(path_regexes))
+	return [_join(group) for group in names], path_matchers
+
+def _join(regexes:ty.List[str]) -> ty.Optional[ty.Callable[[str],ty.Optional[re.Match]]]:
+	if not regexes:
+		return None
+	return re.compile('|'.join(f'(?:{regex})' for regex in regexes), re.DOTALL).fullmatch
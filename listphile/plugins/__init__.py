@@ -0,0 +1,10 @@
+# Properties added by each plugin module's _add_props(), which is only
+# imported when a format uses one of them
+PLUGINS = {
+	'audio': ['duration', 'title', 'artist', 'album', 'album_artist', 'track_num', 'year']
+}
+
+def _register():
+	from .. import format
+	for name, properties in PLUGINS.items():
+		format.add_plugin(properties, f'{__name__}.{name}:_add_props')
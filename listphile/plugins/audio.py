@@ -1,36 +1,134 @@
+from __future__ import annotations
+import collections
+import concurrent.futures
+import json
+import os
 import typing as ty
 import eyed3
 
 from .. import paths, format
+from ..prefetch import process_pool
 
-def _data(item:paths.PathItem) -> ty.Optional[eyed3.core.AudioFile]:
-	if 'audio' not in item._cache:
-		item._cache['audio'] = eyed3.load(str(item.abspath)) if not item.isdir else None
-	return item._cache['audio']
+if ty.TYPE_CHECKING:
+	from .. import config, filelist
 
-def _getYear(item:paths.PathItem):
-	data = _data(item)
-	if data and data.tag:
-		date = data.tag.getBestDate()
-		if date:
-			return date.year or 0
+# Files are only opened if they have one of these extensions (the formats
+# that eyed3 reads)
+EXTENSIONS = {'.mp3'}
+
+# Tag values of a file as a JSON-compatible dict, or None if it's not a
+# tagged audio file
+_Tags = ty.Optional[ty.Dict[str,ty.Any]]
+_MISSING = object()
+
+def read_tags(path:str) -> _Tags:
+	# Module-level so that it can run in worker processes
+	data = eyed3.load(path)
+	if not data or not data.tag:
+		return None
+	date = data.tag.getBestDate()
+	return {
+		'duration'    : int(data.info.time_secs),
+		'title'       : data.tag.title,
+		'artist'      : data.tag.artist,
+		'album'       : data.tag.album,
+		'album_artist': data.tag.album_artist,
+		'track_num'   : data.tag.track_num[0],
+		'year'        : (date.year or 0) if date else None
+	}
+
+def _is_audio(item:paths.PathItem) -> bool:
+	return not item.isdir and os.path.splitext(item.name)[1].lower() in EXTENSIONS
+
+def _data(item:paths.PathItem, options:ty.Optional[config.Options] = None) -> _Tags:
+	tags = item._cached('audio', _MISSING)
+	if tags is _MISSING:
+		tags = item._cache['audio'] = _load(item, options)
+	return tags
+
+def _load(item:paths.PathItem, options:ty.Optional[config.Options] = None) -> _Tags:
+	# Read the tags, or look them up in the cache file
+	if not _is_audio(item):
+		return None
+	cache = options and options._get_cache()
+	if cache is None:
+		return read_tags(item._fspath)
+	return json.loads(cache.fetch(item, 'audio', lambda: json.dumps(read_tags(item._fspath))))
+
+def prefetch(events:ty.Iterable[ty.Tuple[str,paths.PathItem]], options:config.Options, *,
+             workers:int = 1, window:ty.Optional[int] = None
+             ) -> ty.Generator[ty.Tuple[str,paths.PathItem], None, None]:
+	# Read the tags of upcoming files in worker processes, and yield the events
+	# in their original order with the tags stored on their items
+	window = window or 8*workers
+	cache = options._get_cache()
+	pending = collections.deque()
+	with process_pool(workers) as pool:
+		try:
+			for event in events:
+				item_type, item = event
+				future = None
+				if (item_type == 'file' and _is_audio(item) and item._cached('audio', _MISSING) is _MISSING
+				    and item._cached('props') is None and not _is_cached(item, cache)):
+					future = pool.submit(read_tags, item._fspath)
+				pending.append((event, future))
+				if len(pending) > window:
+					yield _finish(*pending.popleft(), options)
+			while pending:
+				yield _finish(*pending.popleft(), options)
+		finally:
+			for _, future in pending:
+				if future is not None:
+					future.cancel()
+
+def _is_cached(item:paths.PathItem, cache:ty.Any) -> bool:
+	# Whether the tags can be taken from the cache file without reading the file
+	if cache is None or cache.verify:
+		return False
+	try:
+		data = item.data
+	except OSError:
+		return False
+	return data.st_size >= cache.min_size and cache.get(data, 'audio') is not None
+
+def _finish(event:ty.Tuple[str,paths.PathItem], future:ty.Optional[concurrent.futures.Future],
+            options:config.Options) -> ty.Tuple[str,paths.PathItem]:
+	if future is not None:
+		tags = future.result() # re-raise errors at the item's position in the stream
+		cache = options._get_cache()
+		if cache is not None:
+			tags = json.loads(cache.fetch(event[1], 'audio', lambda: json.dumps(tags)))
+		event[1]._cache['audio'] = tags
+	return event
+
+def _prefetcher(lister:filelist.FileLister, events:ty.Iterable[ty.Tuple[str,paths.PathItem]]
+                ) -> ty.Iterable[ty.Tuple[str,paths.PathItem]]:
+	workers = lister.options.audio_workers
+	if not workers or not lister.file_format or lister.file_format.props.isdisjoint(PROPERTIES):
+		return events
+	return prefetch(events, lister.options, workers=workers)
+
+def _tag_getter(prop:str, default:ty.Any) -> ty.Callable[[paths.PathItem,config.Options],ty.Any]:
+	def getter(item:paths.PathItem, options:config.Options) -> ty.Any:
+		tags = _data(item, options)
+		return tags[prop] if tags else default
+	return getter
+
+PROPERTIES = {
+	'duration'    : (0,    r'\d+?'),
+	'title'       : ('',   r'.+?'),
+	'artist'      : ('',   r'.+?'),
+	'album'       : ('',   r'.+?'),
+	'album_artist': ('',   r'.+?'),
+	'track_num'   : (0,    r'\d+?'),
+	'year'        : (None, r'\d*?')
+}
 
 def _add_props():
+	from .. import filelist
 	format.Format._get_property.update({
-		'duration'    : lambda item, options: int(_data(item).info.time_secs) if _data(item) and _data(item).tag else 0,
-		'title'       : lambda item, options: _data(item).tag.title if _data(item) and _data(item).tag else '',
-		'artist'      : lambda item, options: _data(item).tag.artist if _data(item) and _data(item).tag else '',
-		'album'       : lambda item, options: _data(item).tag.album if _data(item) and _data(item).tag else '',
-		'album_artist': lambda item, options: _data(item).tag.album_artist if _data(item) and _data(item).tag else '',
-		'track_num'   : lambda item, options: _data(item).tag.track_num[0] if _data(item) and _data(item).tag else 0,
-		'year'        : lambda item, options: _getYear(item)
-	})
+		prop: _tag_getter(prop, default) for prop, (default, _) in PROPERTIES.items()})
 	format.Format._get_regex.update({
-		'duration'    : lambda options: r'\d+?',
-		'title'       : lambda options: r'.+?',
-		'artist'      : lambda options: r'.+?',
-		'album'       : lambda options: r'.+?',
-		'album_artist': lambda options: r'.+?',
-		'track_num'   : lambda options: r'\d+?',
-		'year'        : lambda options: r'\d*?'
-	})
+		prop: (lambda options, regex=regex: regex) for prop, (_, regex) in PROPERTIES.items()})
+	if _prefetcher not in filelist.FileLister._prefetchers:
+		filelist.FileLister._prefetchers.append(_prefetcher)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import queue
+import threading
+import typing as ty
+
+from . import paths
+
+_Event = ty.Tuple[str,paths.PathItem]
+_Job = ty.Callable[[paths.PathItem],ty.Any]
+_T = ty.TypeVar('_T')
+
+def prefetch(events:ty.Iterable[_Event], jobs:ty.Sequence[_Job], *,
+             workers:int = 1, window:ty.Optional[int] = None,
+             item_types:ty.Optional[ty.Container[str]] = None
+             ) -> ty.Generator[_Event, None, None]:
+	# Run the jobs for upcoming items in a thread pool, and yield the events
+	# in their original order once their jobs are done. The jobs are expected
+	# to cache their results on the item (e.g. PathItem.hash()), so that the
+	# consumer can look them up afterwards without redoing the work.
+	window = window or 8*workers
+	pending = collections.deque()
+	pool = concurrent.futures.ThreadPoolExecutor(workers)
+	try:
+		for event in events:
+			if item_types is None or event[0] in item_types:
+				futures = [pool.submit(job, event[1]) for job in jobs]
+			else:
+				futures = []
+			pending.append((event, futures))
+			if len(pending) > window:
+				yield _finish(*pending.popleft())
+		while pending:
+			yield _finish(*pending.popleft())
+	finally:
+		pool.shutdown(wait=True, cancel_futures=True)
+
+def _finish(event:_Event, futures:ty.List[concurrent.futures.Future]) -> _Event:
+	for future in futures:
+		future.result() # re-raise errors at the item's position in the stream
+	return event
+
+def process_pool(workers:int) -> concurrent.futures.ProcessPoolExecutor:
+	# Worker processes are started by a fork server (or spawned, where there
+	# is none) rather than forked, as this process may have other threads
+	# running (walk_workers, hash_workers, read_ahead), whose locks a forked
+	# child could inherit in a held state
+	methods = multiprocessing.get_all_start_methods()
+	context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+	return concurrent.futures.ProcessPoolExecutor(workers, mp_context=context)
+
+def read_ahead(items:ty.Iterable[_T], *, batch_size:int = 256, max_batches:int = 16
+               ) -> ty.Generator[_T, None, None]:
+	# Run an iterator in its own thread, which hands its items over in
+	# batches through a bounded queue. Producing and consuming the items
+	# overlap, while at most max_batches of them are held in memory. If the
+	# consumer stops early, the iterator is closed in its thread.
+	batches = queue.Queue(max_batches)
+	stop = threading.Event()
+	thread = threading.Thread(target=_produce, args=(iter(items), batches, stop, batch_size),
+	                          daemon=True)
+	thread.start()
+	try:
+		while True:
+			batch, error = batches.get()
+			if error is not None:
+				raise error
+			if not batch:
+				return
+			yield from batch
+	finally:
+		stop.set()
+		while thread.is_alive(): # make room for a producer waiting on a full queue
+			try:
+				batches.get(timeout=0.1)
+			except queue.Empty:
+				pass
+
+def _produce(items:ty.Iterator[_T], batches:queue.Queue, stop:threading.Event, batch_size:int):
+	try:
+		while not stop.is_set():
+			batch = list(itertools.islice(items, batch_size))
+			batches.put((batch, None))
+			if not batch:
+				return
+	except BaseException as e:
+		batches.put(([], e))
+	finally:
+		if hasattr(items, 'close'):
+			items.close()
+
+class FolderReader:
+	"""Reads folders in worker threads ahead of a depth-first traversal.
+
+	When a folder has been read, its subfolders are queued for reading, as
+	long as fewer than `limit` of them are queued or waiting to be picked
+	up. The workers take the queued folder that comes first in traversal
+	order. `children()` returns a folder's prefetched contents, or reads it
+	directly if it wasn't queued or hasn't been started yet, so the result
+	is the same as without prefetching."""
+
+	_STOP = (-1,)
+
+	def __init__(self, read:ty.Callable[[paths.PathItem],ty.Iterable[paths.PathItem]], *,
+	             workers:int = 1, limit:ty.Optional[int] = None,
+	             descend:ty.Optional[ty.Callable[[paths.PathItem],bool]] = None):
+		self._read = read
+		self._descend = descend
+		self._budget = threading.Semaphore(limit or 64*workers)
+		self._queue = queue.PriorityQueue()
+		self._counter = itertools.count()
+		self._threads = [threading.Thread(target=self._worker, daemon=True)
+		                 for _ in range(workers)]
+		for thread in self._threads:
+			thread.start()
+
+	def children(self, item:paths.PathItem) -> ty.List[paths.PathItem]:
+		future = item._cache.pop('children', None)
+		if future is None:
+			return self._job(item)
+		self._budget.release()
+		if future.cancel(): # not started yet
+			return self._job(item)
+		return future.result()
+
+	def _job(self, item:paths.PathItem) -> ty.List[paths.PathItem]:
+		children = list(self._read(item))
+		# traversal order: the path of child indices from the root
+		order = item._cache.pop('order', ())
+		for index, child_item in enumerate(children):
+			if not child_item.isdir or (self._descend and not self._descend(child_item)):
+				continue
+			child_order = order + (index,)
+			child_item._cache['order'] = child_order
+			if self._budget.acquire(blocking=False):
+				future = concurrent.futures.Future()
+				child_item._cache['children'] = future
+				self._queue.put((child_order, next(self._counter), child_item, future))
+		return children
+
+	def _worker(self):
+		while True:
+			order, _, item, future = self._queue.get()
+			if order == self._STOP:
+				return
+			if not future.set_running_or_notify_cancel():
+				continue
+			try:
+				future.set_result(self._job(item))
+			except BaseException as e:
+				future.set_exception(e)
+
+	def close(self):
+		for _ in self._threads:
+			self._queue.put((self._STOP, next(self._counter), None, None))
+		for thread in self._threads:
+			thread.join()
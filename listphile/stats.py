@@ -0,0 +1,83 @@
+from __future__ import annotations
+import threading
+import time
+import typing as ty
+
+# Phases of a listing run, in the order they happen to an item
+PHASES = ['read', 'stat', 'hash', 'format', 'write']
+
+class Stats:
+	"""Counts and cumulative phase times (in seconds) of a listing run.
+
+	Work done in worker threads (walk_workers, hash_workers) is added up over
+	the threads, so the phase times can exceed the elapsed time."""
+
+	def __init__(self):
+		self.dirs = 0
+		self.files = 0
+		self.stat_calls = 0
+		self.files_hashed = 0
+		self.bytes_hashed = 0
+		self.lines_written = 0
+		self.times = dict.fromkeys(PHASES, 0.0)
+		self.start_time = time.perf_counter()
+		self.end_time = None
+		self._lock = threading.Lock()
+
+	@property
+	def items(self) -> int:
+		return self.dirs + self.files
+
+	@property
+	def elapsed(self) -> float:
+		return (self.end_time or time.perf_counter()) - self.start_time
+
+	def _add_time(self, phase:str, seconds:float):
+		# For phases that can run in worker threads
+		with self._lock:
+			self.times[phase] += seconds
+
+	def _add_hashed(self, size:int):
+		with self._lock:
+			self.files_hashed += 1
+			self.bytes_hashed += size
+
+	def _merge(self, other:Stats):
+		# Add the counts and times of a part of the run that was counted
+		# separately, e.g. one of two folders walked at the same time
+		with self._lock:
+			self.dirs += other.dirs
+			self.files += other.files
+			self.stat_calls += other.stat_calls
+			self.files_hashed += other.files_hashed
+			self.bytes_hashed += other.bytes_hashed
+			self.lines_written += other.lines_written
+			for phase, seconds in other.times.items():
+				self.times[phase] += seconds
+
+	def as_dict(self) -> ty.Dict[str,ty.Any]:
+		return {'dirs': self.dirs, 'files': self.files, 'stat_calls': self.stat_calls,
+		        'files_hashed': self.files_hashed, 'bytes_hashed': self.bytes_hashed,
+		        'lines_written': self.lines_written, 'elapsed': self.elapsed,
+		        'times': dict(self.times)}
+
+	def __repr__(self) -> str:
+		return f'Stats({self.as_dict()})'
+
+	def __str__(self) -> str:
+		elapsed = self.elapsed
+		lines = [f'{self.dirs} folders, {self.files} files in {elapsed:.2f} s'
+		         + (f' ({self.items/elapsed:.0f} items/s)' if elapsed else ''),
+		         f'{self.stat_calls} stat calls, {self.lines_written} lines written',
+		         f'{self.files_hashed} files hashed ({_format_size(self.bytes_hashed)})']
+		lines += [f'{phase:<7}{seconds:9.2f} s' for phase, seconds in self.times.items()]
+		return '\n'.join(lines)
+
+def _format_size(size:int) -> str:
+	for unit in ('B', 'KiB', 'MiB', 'GiB'):
+		if size < 1024:
+			break
+		size /= 1024
+	else:
+		unit = 'TiB'
+	return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
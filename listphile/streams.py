@@ -0,0 +1,227 @@
+from __future__ import annotations
+import bz2
+import gzip
+import io
+import lzma
+import tempfile
+import time
+import typing as ty
+
+from . import config_helpers as ch
+from . import paths
+
+if ty.TYPE_CHECKING:
+	from . import stats as _stats
+
+_extensions = {
+	'.gz'  : ch.CompressionType.GZIP,
+	'.bz2' : ch.CompressionType.BZ2,
+	'.xz'  : ch.CompressionType.LZMA,
+	'.lzma': ch.CompressionType.LZMA
+}
+_magic = [
+	(b'\x1f\x8b', ch.CompressionType.GZIP),
+	(b'BZh', ch.CompressionType.BZ2),
+	(b'\xfd7zXZ\x00', ch.CompressionType.LZMA),
+	(b'\x5d\x00\x00', ch.CompressionType.LZMA) # legacy .lzma
+]
+_MAGIC_SIZE = max(len(magic) for magic, _ in _magic)
+# gzip's default level 9 is about twice as slow as 6 for little gain
+_default_levels = {
+	ch.CompressionType.GZIP: 6,
+	ch.CompressionType.BZ2 : 9,
+	ch.CompressionType.LZMA: 6
+}
+_openers = {
+	ch.CompressionType.GZIP: gzip.open,
+	ch.CompressionType.BZ2 : bz2.open,
+	ch.CompressionType.LZMA: lzma.open
+}
+
+def get_compression(path:paths.PathOrStr,
+                    compression:ty.Union[ch.CompressionType,str,None] = None
+                    ) -> ch.CompressionType:
+	# Explicit compression type, or else based on the file extension
+	if compression is not None:
+		return ch._get_enum(ch.CompressionType, compression)
+	suffix = paths._parse_path(path).suffix.lower()
+	return _extensions.get(suffix, ch.CompressionType.NONE)
+
+def detect_compression(path:paths.PathOrStr) -> ch.CompressionType:
+	# Compression type based on the file's first bytes. This reads from the
+	# file, so it's only for regular files; open_list() detects it on the
+	# opened stream instead.
+	with open(str(path), 'rb') as file:
+		return _detect(file.read(_MAGIC_SIZE))
+
+def _detect(start:bytes) -> ch.CompressionType:
+	for magic, compression in _magic:
+		if start.startswith(magic):
+			return compression
+	return ch.CompressionType.NONE
+
+def open_list(path:paths.PathOrStr, mode:str = 'r', *,
+              compression:ty.Union[ch.CompressionType,str,None] = None,
+              compression_level:ty.Optional[int] = None,
+              buffer_size:int = 1024*1024,
+              stats:ty.Optional[_stats.Stats] = None) -> ty.TextIO:
+	"""Open a list file for reading ('r'), writing ('w') or appending ('a')
+	in text mode, through a compressor if needed. When reading without an
+	explicit compression type, it is detected from the file contents.
+	Text is collected in buffers of `buffer_size` bytes, to keep the number
+	of writes to the underlying file (and compressor calls) low. If `stats`
+	is given, the time spent in those writes is added to its 'write' time."""
+	if mode == 'r':
+		return _open_reader(path, compression, buffer_size)
+	compression = get_compression(path, compression)
+
+	if compression == ch.CompressionType.NONE and stats is None:
+		file = open(str(path), mode, encoding='utf-8', buffering=buffer_size)
+	elif compression == ch.CompressionType.NONE:
+		raw = _TimedWriter(io.FileIO(str(path), mode), stats)
+		file = io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), encoding='utf-8')
+	else:
+		level = _default_levels[compression] if compression_level is None \
+		        else compression_level
+		raw = _openers[compression](str(path), mode + 'b', **{
+			'preset' if compression == ch.CompressionType.LZMA
+			else 'compresslevel': level})
+		if stats is not None:
+			raw = _TimedWriter(raw, stats)
+		file = io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), encoding='utf-8')
+	return file
+
+def _open_reader(path:paths.PathOrStr,
+                 compression:ty.Union[ch.CompressionType,str,None],
+                 buffer_size:int) -> ty.TextIO:
+	# The file is only opened once, and the compression is detected by
+	# peeking at its buffer, so that pipes can be read as well
+	file = open(str(path), 'rb', buffering=buffer_size)
+	try:
+		if compression is None:
+			compression = _detect(file.peek(_MAGIC_SIZE)[:_MAGIC_SIZE])
+		else:
+			compression = ch._get_enum(ch.CompressionType, compression)
+		if compression != ch.CompressionType.NONE:
+			raw = _Decompressor(_openers[compression](file, 'rb'), file)
+			file = io.BufferedReader(raw, buffer_size)
+	except BaseException:
+		file.close()
+		raise
+	return io.TextIOWrapper(file, encoding='utf-8')
+
+class _Decompressor(io.RawIOBase):
+	# Decompressed input from an opened file, which the decompressor
+	# doesn't close itself
+	def __init__(self, raw:ty.BinaryIO, file:ty.BinaryIO):
+		self._raw = raw
+		self._file = file
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, buffer) -> int:
+		return self._raw.readinto(buffer)
+
+	def close(self):
+		if not self.closed:
+			try:
+				self._raw.close()
+			finally:
+				self._file.close()
+				super().close()
+
+class _TimedWriter(io.RawIOBase):
+	# Pass-through for a binary output stream that times its writes, which
+	# only happen when a buffer is full
+	def __init__(self, raw:ty.BinaryIO, stats:_stats.Stats):
+		self._raw = raw
+		self._stats = stats
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data:bytes) -> int:
+		start = time.perf_counter()
+		try:
+			return self._raw.write(data)
+		finally:
+			self._stats.times['write'] += time.perf_counter() - start
+
+	def fileno(self) -> int:
+		return self._raw.fileno()
+
+	def close(self):
+		if not self.closed:
+			# compressors write their last block when closed
+			start = time.perf_counter()
+			try:
+				self._raw.close()
+			finally:
+				self._stats.times['write'] += time.perf_counter() - start
+				super().close()
+
+class DeferredLines:
+	"""Text output in which some lines are only filled in later, such as
+	folder lines with the totals of their contents.
+
+	`defer()` reserves a line at the current position. While any reserved
+	line is still missing, the following lines are collected in a temporary
+	file, which is kept in memory up to `max_size` characters. Once the last
+	one is filled in, the collected text is copied to the output with the
+	reserved lines in place. Otherwise, lines are written through directly."""
+
+	def __init__(self, file:ty.TextIO, *, max_size:int = 16*1024*1024):
+		self._file = file
+		self._max_size = max_size
+		self._spool = None
+		self._size = 0 # characters collected
+		self._slots = [] # [position, line] of the reserved lines, in order
+		self._missing = 0
+
+	def write(self, text:str) -> int:
+		if not self._slots:
+			return self._file.write(text)
+		self._size += len(text)
+		return self._spool.write(text)
+
+	def defer(self) -> int:
+		# Reserve a line at the current position; returns its slot number
+		if self._spool is None:
+			self._spool = tempfile.SpooledTemporaryFile(self._max_size, mode='w+',
+			                                            encoding='utf-8', newline='')
+		self._slots.append([self._size, None])
+		self._missing += 1
+		return len(self._slots) - 1
+
+	def fill(self, slot:int, line:str):
+		self._slots[slot][1] = line
+		self._missing -= 1
+		if self._missing == 0:
+			self._flush()
+
+	def _flush(self, chunk_size:int = 1024*1024):
+		spool, file = self._spool, self._file
+		spool.seek(0)
+		position = 0
+		for slot_position, line in self._slots:
+			while position < slot_position:
+				text = spool.read(min(chunk_size, slot_position - position))
+				file.write(text)
+				position += len(text)
+			file.write(line)
+		while True:
+			text = spool.read(chunk_size)
+			if not text:
+				break
+			file.write(text)
+		spool.seek(0)
+		spool.truncate()
+		self._size = 0
+		self._slots = []
+
+	def close(self):
+		# Lines that are still missing (after an error) are dropped
+		if self._spool is not None:
+			self._spool.close()
+			self._spool = None